@@ -10,6 +10,7 @@
 
 """
 This component transforms a list of horizontal and vertical angles representing far field obstructions in CitySim format.
+The angles can also be computed from context meshes and/or an elevation raster, as the maximum height angle in each azimuth sector.
 
 -
 This component will hopefully be part of
@@ -23,23 +24,201 @@ Ladybug: A Plugin for Environmental Analysis (GPL) started by Mostapha Sadeghipo
     Args:
         H: List of horizontal angles
         V: List of vertical angles (obstructions)
+        Context: List of meshes of the far field (replace H and V). Use the same Center and Radius in CitySim-Srf to exclude these faces from the shading surfaces
+        DEM: Path of a digital elevation model in ESRI ASCII grid format (.asc), in the same coordinates as the model (replace H and V, combined with Context)
+        Center: Point from which the horizon is seen (e.g. centroid of the district). Default = center of the bottom of the bounding box of the meshes, or center of the DEM at ground level
+        Radius: Only faces with all vertices farther than Radius (m, horizontal distance) from the Center are considered, and the DEM is read from this distance. Default = 0
+        Bins: Number of azimuth sectors. Default = 36
+        Step: Distance (m) between the points of the DEM read along each azimuth. Default = cell size of the DEM
         dir: directory of project
         name: title of project
         Write: Boolean to start
+    Returns:
+        CSobj: Path of the horizon file
+        Phi: Horizontal angles (azimuth from North, clockwise)
+        Theta: Vertical angles (height of the obstructions)
 """
 
 ghenv.Component.Name = "Honeybee_CitySim-Horizon"
 ghenv.Component.NickName = 'CitySim-Horizon'
-ghenv.Component.Message = 'VER 0.0.3\nAVR_01_2017'
+ghenv.Component.Message = 'VER 0.0.4\nOCT_18_2026'
 ghenv.Component.IconDisplayMode = ghenv.Component.IconDisplayMode.application
 ghenv.Component.Category = "Honeybee"
 ghenv.Component.SubCategory = "14 | CitySim"
 ghenv.Component.AdditionalHelpFromDocStrings = "1"
 
 import rhinoscriptsyntax as rs
+import Rhino as rc
+import Grasshopper.Kernel as gh
+import math
+import array
+
+def isFar(points,center,radius):
+    #True if all points are farther than radius (horizontal distance) from center
+    for p in points:
+        if (p.X-center.X)**2 + (p.Y-center.Y)**2 <= radius**2:
+            return False
+    return True
+
+def getFaces(meshes,center,radius):
+    #Vertices of the faces farther than radius from center
+    faces = []
+    for mesh in meshes:
+        for face in mesh.Faces:
+            if face.IsQuad:
+                points = [mesh.Vertices[face.A],mesh.Vertices[face.B],mesh.Vertices[face.C],mesh.Vertices[face.D]]
+            else:
+                points = [mesh.Vertices[face.A],mesh.Vertices[face.B],mesh.Vertices[face.C]]
+            if isFar(points,center,radius):
+                faces.append([(p.X-center.X,p.Y-center.Y,p.Z-center.Z) for p in points])
+    return faces
+
+def getHorizon(faces,bins):
+    #Maximum height angle (degrees) in each azimuth sector, sector k is centered on k*360/bins from North, clockwise
+    #Each edge is intersected with the central ray of every sector it spans, vertices are added to their sector
+    width = 360.0/bins
+    theta = array.array('d',[0.0]*bins)
+    def add(k,x,y,z):
+        elevation = math.degrees(math.atan2(z,math.sqrt(x*x+y*y)))
+        if elevation > theta[k % bins]:
+            theta[k % bins] = elevation
+    for face in faces:
+        for i in xrange(len(face)):
+            x0, y0, z0 = face[i]
+            x1, y1, z1 = face[(i+1)%len(face)]
+            a0 = math.degrees(math.atan2(x0,y0))
+            add(int(round(a0/width)),x0,y0,z0)
+            span = (math.degrees(math.atan2(x1,y1))-a0+180) % 360 - 180 #Signed, shortest way
+            for k in xrange(int(math.ceil(min(a0,a0+span)/width)),int(math.floor(max(a0,a0+span)/width))+1):
+                dx = math.sin(math.radians(k*width))
+                dy = math.cos(math.radians(k*width))
+                denominator = dx*(y1-y0)-dy*(x1-x0)
+                if denominator == 0: #Edge along the ray
+                    continue
+                t = (dy*x0-dx*y0)/denominator
+                if 0 <= t <= 1:
+                    x = x0+t*(x1-x0)
+                    y = y0+t*(y1-y0)
+                    if x*dx+y*dy > 0:
+                        add(k,x,y,z0+t*(z1-z0))
+    return theta
+
+class Raster(object):
+    """Elevation grid read from an ESRI ASCII file"""
+    
+    def __init__(self,path):
+        in_file = open(path,"r")
+        header = {}
+        while len(header) < 6:
+            line = in_file.readline().split()
+            if line[0].lower() == "nodata_value":
+                header["nodata_value"] = float(line[1])
+            elif not line[0][0].isalpha(): #No nodata_value, first row of data
+                header["nodata_value"] = None
+                first = line
+                break
+            else:
+                header[line[0].lower()] = float(line[1])
+        self.ncols = int(header["ncols"])
+        self.nrows = int(header["nrows"])
+        self.cellsize = header["cellsize"]
+        self.nodata = header["nodata_value"]
+        if "xllcorner" in header: #Coordinates of the center of the lower left cell
+            self.x0 = header["xllcorner"] + self.cellsize/2
+            self.y0 = header["yllcorner"] + self.cellsize/2
+        else:
+            self.x0 = header["xllcenter"]
+            self.y0 = header["yllcenter"]
+        self.data = array.array('f')
+        if header["nodata_value"] == None:
+            self.data.extend([float(v) for v in first])
+        for line in in_file:
+            self.data.extend([float(v) for v in line.split()])
+        in_file.close()
+    
+    def center(self):
+        x = self.x0 + (self.ncols-1)*self.cellsize/2
+        y = self.y0 + (self.nrows-1)*self.cellsize/2
+        return x, y, self.elevation(x,y)
+    
+    def elevation(self,x,y):
+        #Bilinear interpolation, None outside of the grid or on missing data
+        c = (x-self.x0)/self.cellsize
+        r = (self.nrows-1) - (y-self.y0)/self.cellsize #Rows are from North to South
+        if c < 0 or r < 0 or c > self.ncols-1 or r > self.nrows-1:
+            return None
+        c0 = min(int(c),self.ncols-2)
+        r0 = min(int(r),self.nrows-2)
+        i = r0*self.ncols+c0
+        z = [self.data[i],self.data[i+1],self.data[i+self.ncols],self.data[i+self.ncols+1]]
+        if self.nodata in z:
+            return None
+        dc = c-c0
+        dr = r-r0
+        return (z[0]*(1-dc)+z[1]*dc)*(1-dr) + (z[2]*(1-dc)+z[3]*dc)*dr
+
+def getRasterHorizon(raster,center,radius,bins,step):
+    #Maximum height angle (degrees) of the terrain along the azimuth at the center of each sector
+    theta = array.array('d',[0.0]*bins)
+    for k in xrange(bins):
+        dx = math.sin(math.radians(k*360.0/bins))
+        dy = math.cos(math.radians(k*360.0/bins))
+        d = max(radius,step)
+        while True:
+            z = raster.elevation(center.X+d*dx,center.Y+d*dy)
+            if z == None:
+                break
+            elevation = math.degrees(math.atan2(z-center.Z,d))
+            if elevation > theta[k]:
+                theta[k] = elevation
+            d += step
+    return theta
 
 ReqInputs = True
 
+if Bins != None and Bins < 1:
+    warning = "Bins must be at least 1"
+    ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
+    print warning
+    ReqInputs = False
+
+if Step != None and Step <= 0:
+    warning = "Step must be greater than 0"
+    ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
+    print warning
+    ReqInputs = False
+
+if ReqInputs and (Context or DEM):
+    if Bins == None:
+        Bins = 36
+    if Radius == None:
+        Radius = 0
+    if DEM:
+        raster = Raster(DEM)
+        if Step == None:
+            Step = raster.cellsize
+    if Center != None:
+        Center = rs.coerce3dpoint(Center)
+    else:
+        if Context:
+            bbox = rc.Geometry.BoundingBox.Empty
+            for mesh in Context:
+                bbox.Union(mesh.GetBoundingBox(True))
+            Center = rc.Geometry.Point3d(bbox.Center.X,bbox.Center.Y,bbox.Min.Z)
+        else:
+            x, y, z = raster.center()
+            Center = rc.Geometry.Point3d(x,y,z)
+    theta = array.array('d',[0.0]*Bins)
+    if Context:
+        theta = getHorizon(getFaces(Context,Center,Radius),Bins)
+    if DEM:
+        terrain = getRasterHorizon(raster,Center,Radius,Bins,Step)
+        theta = array.array('d',[max(t) for t in zip(theta,terrain)])
+    H = [k*360.0/Bins for k in xrange(Bins)] + [360.0]
+    V = [round(t,2) for t in theta] + [round(theta[0],2)]
+    Phi = H
+    Theta = V
+
 if H == None or V == None:
     print "Add angles"
     ReqInputs = False
@@ -30,18 +30,25 @@ Ladybug: A Plugin for Environmental Analysis (GPL) started by Mostapha Sadeghipo
         directory: Directory
         name: name of the project
         yearly: calculate yearly values
+        period: aggregate the hourly values: hourly (default), daily, monthly, profile (average day) or a comma-separated list of first hours of custom periods
+        stat: statistic for each period: sum (default), mean, max, min or peak (hour of the year of the maximum)
+        selection: List of buildings (e.g. "0") or surfaces (e.g. "0-2") to load; non-selected surfaces (and buildings in H, C and TH) return -1. Default = all
+        THvars: List of thermal variables to load from the TH output, e.g. Ta, Qi, Qs, VdotVent, MachinePower, FuelConsumption, ElectricConsumption
         _HBZones: Import _HBZones
+        Export: set Boolean to True to export all the outputs to <name>_columns: one NumPy .npy file per output and an index of the columns (building, surface, variable, unit) in columns.json
         Run: set Boolean to True to load the results
     Returns:
         SW: Shortwave irradiation {Building;Surface}
         H: Heating needs {Building}
         C: Cooling needs {Building}
+        TH: Thermal variables listed in THvars {Variable;Building}
+        Results: All the output files of the project, loaded on demand, e.g. Results.get("HC","hc")
         Geometry: Curves of input geometry {Building;Surface}
 """
 
 ghenv.Component.Name = "Honeybee_CitySim-LoadResults"
 ghenv.Component.NickName = 'CitySim-LoadResults'
-ghenv.Component.Message = 'VER 0.2.3\nFEB_26_2019'
+ghenv.Component.Message = 'VER 0.2.4\nOCT_18_2026'
 ghenv.Component.Category = "Honeybee"
 ghenv.Component.SubCategory = "14 | CitySim"
 #compatibleHBVersion = VER 0.0.67\nNOV_20_2018
@@ -51,25 +58,58 @@ except: pass
 
 import rhinoscriptsyntax as rs
 import scriptcontext as sc
+import Grasshopper.Kernel as gh
 import uuid
+import array
+import os
+import operator
+import threading
+import struct
+import json
+import sys
 
 hb_hive = sc.sticky["honeybee_Hive"]()
 
-geometry = []
 if dir != None:
     dir += "\\" #Add \ in case is missing
 
-HBO = hb_hive.callFromHoneybeeHive(_HBZones)
-for b in HBO:
-    crvs = []
-    HBSurfaces  = hb_hive.addToHoneybeeHive(b.surfaces, ghenv.Component)
-    for s in HBSurfaces:
-        edges = rs.DuplicateEdgeCurves(s)
-        crvs.append(rs.JoinCurves(edges))
-    geometry.append(crvs)
+#Get surfaces from Honeybee zones
+def getSurfaces(HBZones):
+    geometry = []
+    HBO = hb_hive.callFromHoneybeeHive(HBZones)
+    for b in HBO:
+        crvs = []
+        HBSurfaces  = hb_hive.addToHoneybeeHive(b.surfaces, ghenv.Component)
+        for s in HBSurfaces:
+            edges = rs.DuplicateEdgeCurves(s)
+            crvs.append(rs.JoinCurves(edges))
+        geometry.append(crvs)
+    return geometry
     
 
 
+class Job(threading.Thread):
+    """Runs a function on a separate thread and keeps its result"""
+    def __init__(self, func, *args):
+        threading.Thread.__init__(self)
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+    
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception, e:
+            self.error = e
+    
+    def get(self):
+        #Wait for the function to finish and return its result
+        self.join()
+        if self.error != None:
+            raise self.error
+        return self.result
+
 def list_to_tree(input, none_and_holes=True, source=[0]):
     """Transforms nestings of lists or tuples to a Grasshopper DataTree"""
     # written by Giulio Piacentino, giulio@mcneel.com
@@ -88,15 +128,132 @@ def list_to_tree(input, none_and_holes=True, source=[0]):
     if input is not None: t=Tree[object]();proc(input,t,source[:]);return t
     
     
-def loadOut(path,name,type="SW"):
-    #Load SW output file
-    in_file = open(path+name+"_"+type+".out","r")
-    txt = in_file.read()
+def readHeader(filepath):
+    #Read only the first line of an output file
+    in_file = open(filepath,"r")
+    header = in_file.readline()
     in_file.close()
-    results = txt.splitlines()
-    header = results[0]
-    results.pop(0) #remove header
-    return header, results
+    return header
+
+def loadArray(filepath,columns=None,labels=None):
+    #Load output file into a contiguous float32 array (hours x columns, row by row)
+    #If a list of columns is given, only those are converted and the header is restricted to them
+    #If a list of labels is given, the first value of each row is a title appended to it (e.g. Area(m2))
+    in_file = open(filepath,"r")
+    header = in_file.readline()
+    ncols = len(header.split())
+    data = array.array('f')
+    for l in in_file: #for each line corresponding to a hour
+        values = l.split()
+        if len(values) != ncols:
+            continue #skip empty or truncated lines
+        if labels != None:
+            labels.append(values[0])
+            values[0] = "nan"
+        if columns == None:
+            data.extend([float(i) for i in values])
+        else:
+            data.extend([float(values[c]) for c in columns])
+    in_file.close()
+    if columns != None:
+        header, ncols = selectHeader(header,columns)
+    return header, data, ncols
+
+def selectHeader(header,columns):
+    #Header restricted to the selected columns
+    titles = header.split()
+    return "\t".join([titles[c] for c in columns]), len(columns)
+
+def takeColumns(data,ncols,columns):
+    #Copy the selected columns of an array into a new array
+    selected = array.array(data.typecode)
+    for r in xrange(0,len(data),ncols): #for each row
+        selected.extend([data[r+c] for c in columns])
+    return selected
+
+class Column(object):
+    """Series of one column of the results array (a view, values are not copied)"""
+    def __init__(self, data, col, ncols):
+        self.data = data
+        self.col = col
+        self.ncols = ncols
+    
+    def __len__(self):
+        return len(self.data) // self.ncols
+    
+    def __getitem__(self, h):
+        if isinstance(h,slice): #values of a range of hours, e.g. a month
+            start, stop, step = h.indices(len(self))
+            if stop <= start:
+                return self.data[0:0]
+            return self.data[start*self.ncols+self.col:(stop-1)*self.ncols+self.col+1:step*self.ncols]
+        if h < 0:
+            h += len(self)
+        if h < 0 or h >= len(self):
+            raise IndexError("hour out of range")
+        return self.data[h*self.ncols+self.col]
+    
+    def __iter__(self):
+        data = self.data
+        for i in xrange(self.col, len(data), self.ncols):
+            yield data[i]
+
+def loadCached(filepath,columns=None):
+    #Load output file from its binary sidecar, which is rebuilt when the output changes
+    #Sidecar: key line (path, size, mtime), output header, array size, raw float32 values
+    #A selection of columns is taken from a valid sidecar, otherwise only those columns are parsed
+    stat = os.stat(filepath)
+    key = "CitySimCache 1\t{0}\t{1}\t{2}\n".format(os.path.abspath(filepath),stat.st_size,repr(stat.st_mtime))
+    cachepath = filepath+".cache"
+    if os.path.exists(cachepath):
+        in_file = open(cachepath,"rb")
+        try:
+            if in_file.readline() == key:
+                header = in_file.readline()
+                ncols, nvalues = [int(i) for i in in_file.readline().split()]
+                data = array.array('f')
+                data.fromfile(in_file,nvalues)
+                if columns != None:
+                    data = takeColumns(data,ncols,columns)
+                    header, ncols = selectHeader(header,columns)
+                return header, data, ncols
+        except (ValueError, EOFError):
+            pass #incomplete sidecar: parse the text file again
+        finally:
+            in_file.close()
+    if columns != None:
+        return loadArray(filepath,columns) #a partial array is not cached
+    header, data, ncols = loadArray(filepath)
+    try:
+        out_file = open(cachepath,"wb")
+        out_file.write(key)
+        out_file.write(header.rstrip("\r\n")+"\n")
+        out_file.write("{0} {1}\n".format(ncols,len(data)))
+        data.tofile(out_file)
+        out_file.close()
+    except (IOError, OSError):
+        print "Could not write cache file " + cachepath
+    return header, data, ncols
+
+def sumOut(filepath,columns=None):
+    #Sum each column of an output file reading one line at a time
+    #Returns the totals as a single row, so that only one value per column is kept in memory
+    in_file = open(filepath,"r")
+    header = in_file.readline()
+    nvalues = len(header.split())
+    ncols = nvalues
+    if columns != None:
+        header, ncols = selectHeader(header,columns)
+    totals = [0.0]*ncols
+    for l in in_file: #for each line corresponding to a hour
+        values = l.split()
+        if len(values) != nvalues:
+            continue #skip empty or truncated lines
+        if columns != None:
+            values = [values[c] for c in columns]
+        totals = map(operator.add,totals,map(float,values))
+    in_file.close()
+    return header, array.array('d',totals), ncols
 
 def parseHead(head):        
     #Parse header
@@ -119,23 +276,11 @@ def parseHead(head):
             sIDs.append(int(s))
     return bIDs, sIDs
 
-def parseRes(results,sIDs):
-    #Parse results
-    irrH = []
-
-    for l in results: #for each line corresponding to a hour
-        bldg = []
-        isrf = []
-        for i in l.split(): #split the surfaces
-            isrf.append(float(i))
-        irrH.append(isrf)
-    #print len(isrf)
+def parseRes(data,ncols):
+    #Parse results into one series per column
     irrS = []
-    for s in xrange(len(sIDs)): #for each surface
-        srf = []
-        for h in range(len(irrH)): #for each hour
-            srf.append(irrH[h][s])
-        irrS.append(srf)
+    for s in xrange(ncols): #for each surface
+        irrS.append(Column(data,s,ncols))
     return irrS
 
 def removeTerr(irrS,bIDs,sIDs):   
@@ -144,100 +289,314 @@ def removeTerr(irrS,bIDs,sIDs):
     sIDs2 = []
     IDs = []
     irrS2 = []
-    annIrr = []
     for s in xrange(len(bIDs)):
         if bIDs[s] != "NA" and bIDs[s] != "" : #remove columns
             sIDs2.append(int(sIDs[s]))
             bIDs2.append(int(bIDs[s]))
             IDs.append([int(bIDs[s]),int(sIDs[s])])
             irrS2.append(irrS[s])
-            annIrr.append(sum(irrS[s])/1000)
-    return irrS2, bIDs2, sIDs2, annIrr
+    return irrS2, bIDs2, sIDs2
 
 
-def ParseTHhead(THhead):
-    #Parse header
+def indexColumns(bIDs2,sIDs2,geometry):
+    #Result column of each surface in the geometry, building by building (-1 if missing)
+    columns = {}
+    for i in xrange(len(bIDs2)):
+        columns[(bIDs2[i],sIDs2[i])] = i
+    index = []
+    for b in xrange(len(geometry)):
+        index.append([columns.get((b,s),-1) for s in xrange(len(geometry[b]))])
+    return index
+
+def parseColumn(title):
+    #Split a column title, e.g. 0(1):1:Heating(Wh), into building, surface (or zone), variable and unit
     import re
-    header = THhead.split()
-    #header.pop(0)
-    print header
-    
-def ParseTHres(THres,yrl=False):
-    nbuildings = (len(THres[0].split())-1)/12
-    heating = []
-    cooling = []
-    for i in THres:
-        values = i.split()
-        heat = []
-        cool = []
-        for h in xrange(2,len(values),len(values)/nbuildings):
-            heat.append(float(values[h]))
-            cool.append(float(values[h+1]))
-        heating.append(heat)
-        cooling.append(cool)
-    #for each building
-    heating2 = []
-    cooling2 = []
-    for b in xrange(nbuildings): #for each surface
-        heat = []
-        cool = []
-        for h in xrange(len(heating)): #for each hour
-              heat.append(heating[h][b])
-              cool.append(cooling[h][b])
+    m = re.match(r'^(\w+)\((\w+)\):(\d+)?:?(?:([^(]+)\((.*)\))?$', title.lstrip("#"))
+    if m == None:
+        return None #columns not related to a building, e.g. #timeStep
+    b, key, n, var, unit = m.groups()
+    if b.isdigit():
+        b = int(b)
+    if n != None:
+        n = int(n)
+    return b, n, var, unit
+
+def selectColumns(header,selection,level="surface"):
+    #Resolve a selection of buildings ("0") or surfaces ("0-2") to the columns of an output file
+    #With level="building" (e.g. TH output) a selected surface selects its whole building
+    if selection == None or len(selection) == 0:
+        return None #all columns
+    bldgs = set()
+    srfs = set()
+    for item in selection:
+        ids = str(item).split("-")
+        if len(ids) == 1:
+            bldgs.add(int(ids[0]))
+        else:
+            srfs.add((int(ids[0]),int(ids[1])))
+    if level == "building":
+        bldgs.update([b for b, s in srfs])
+    columns = [0] #the first column is not related to buildings but is always kept
+    for c, title in enumerate(header.split()):
+        key = parseColumn(title)
+        if c == 0 or key == None:
+            continue
+        if key[0] in bldgs or (level == "surface" and (key[0],key[1]) in srfs):
+            columns.append(c)
+    return columns
+
+def ParseTHhead(THhead):
+    #Index the header: (building, zone, variable, unit) -> column
+    index = {}
+    for c, title in enumerate(THhead.split()):
+        key = parseColumn(title)
+        if key != None:
+            index[key] = c
+    return index
+    
+def ParseTHres(data,ncols,index,variable,nbuildings,yrl=False):
+    #Extract one variable for each building id (its first zone), -1 for buildings not loaded
+    columns = {}
+    for key in sorted([k for k in index.keys() if k[2] == variable],reverse=True):
+        columns[key[0]] = index[key]
+    results = []
+    for b in xrange(nbuildings):
+        if b not in columns:
+            results.append([-1]) #building not selected
+            continue
+        values = Column(data,columns[b],ncols)
         if yrl:
-            heating2.append([sum(heat)])
-            cooling2.append([sum(cool)])
+            results.append([sum(values)])
         else:
-            heating2.append(heat)
-            cooling2.append(cool)
-    return heating2, cooling2
+            results.append(values)
+    return results
    
-if Run:
-    header, results = loadOut(dir,name,"SW")
-    THhead, THres = loadOut(dir,name,type="TH")
+MONTHDAYS = [31,28,31,30,31,30,31,31,30,31,30,31]
+PERIODS = ["hourly","daily","monthly","yearly","profile"]
+STATS = ["sum","mean","max","min","peak"]
+
+def isPeriod(period):
+    #True if period is one of PERIODS or a comma-separated list of first hours
+    if period in PERIODS:
+        return True
+    try:
+        return all([int(h) >= 0 for h in str(period).split(",")])
+    except ValueError:
+        return False
+
+def periodStarts(period,nhours):
+    #Index of the first hour of each period (contiguous periods, as in numpy's reduceat)
+    if period == "daily":
+        return range(0,nhours,24)
+    elif period == "monthly":
+        starts = [0]
+        for d in MONTHDAYS[:-1]:
+            starts.append(starts[-1]+d*24)
+    elif period == "yearly":
+        starts = [0]
+    else: #custom periods: comma-separated list of first hours, e.g. "0,2160,4344,6552"
+        starts = sorted([int(h) for h in str(period).split(",")])
+    return [h for h in starts if h < nhours]
+
+def aggregate(series,period="monthly",stat="sum"):
+    #Aggregate an hourly series by period: daily, monthly, yearly, profile (average day) or custom
+    #stat: sum, mean, max, min or peak (hour of the year of the maximum)
+    if len(series) <= 1:
+        return list(series) #missing surfaces and yearly totals
+    if stat == "peak":
+        func = lambda v, first: first + list(v).index(max(v))
+    else:
+        func = {"sum": lambda v, first: sum(v),
+                "mean": lambda v, first: sum(v)/float(len(v)),
+                "max": lambda v, first: max(v),
+                "min": lambda v, first: min(v)}[stat]
+    n = len(series)
+    if period == "profile": #values grouped by hour of the day
+        return [func(series[h::24],h) for h in xrange(min(24,n))]
+    starts = periodStarts(period,n)
+    ends = starts[1:] + [n]
+    return [func(series[starts[i]:ends[i]],starts[i]) for i in xrange(len(starts))]
+
+class CitySimResults(object):
+    """Output files of a CitySim project, loaded on first access of each variable"""
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.files = {} #type of output (e.g. SW, TH, HC) -> path
+        self.labels = {} #row titles of outputs that are not hourly (e.g. VF, Area)
+        self.indexes = {}
+        self.series = {}
+        for f in os.listdir(path):
+            if f.startswith(name+"_") and f.endswith(".out"):
+                type = f[len(name)+1:-len(".out")]
+                if type not in ["YearlyResults","Inertia"]: #not tables
+                    self.files[type] = path+f
+    
+    def __repr__(self):
+        return "CitySimResults: {0} ({1})".format(self.name,", ".join(self.types()))
+    
+    def types(self):
+        return sorted(self.files.keys())
+    
+    def index(self, type):
+        #Header index: (building, surface or zone, variable, unit) -> column
+        #Columns not related to a building are indexed by their title (e.g. Tout)
+        if type not in self.indexes:
+            in_file = open(self.files[type],"r")
+            header = in_file.readline()
+            row = in_file.readline().split()
+            in_file.close()
+            try:
+                if len(row) > 0:
+                    float(row[0])
+            except ValueError:
+                self.labels[type] = []
+            index = {}
+            for c, title in enumerate(header.split()):
+                key = parseColumn(title)
+                if key == None:
+                    key = title
+                index[key] = c
+            self.indexes[type] = index
+        return self.indexes[type]
+    
+    def variables(self, type):
+        #Names of the variables of an output (None for SW, which has no variable name)
+        names = set()
+        for key in self.index(type).keys():
+            if isinstance(key,tuple):
+                names.add(key[2])
+            else:
+                names.add(key)
+        return sorted(names)
+    
+    def load(self, type, columns=None):
+        #Array of an output (all columns or a selection): header, data, ncols
+        self.index(type) #check for row titles
+        if type in self.labels: #small tables with row titles: not cached
+            self.labels[type] = []
+            return loadArray(self.files[type],columns,self.labels[type])
+        return loadCached(self.files[type],columns)
+    
+    def get(self, type, variable=None):
+        #List of (key, series) of a variable, e.g. get("TH","Heating") or get("SW")
+        if (type,variable) not in self.series:
+            index = self.index(type)
+            keys = sorted([k for k in index.keys() if k == variable or (isinstance(k,tuple) and k[2] == variable)])
+            header, data, ncols = self.load(type,[index[k] for k in keys])
+            self.series[(type,variable)] = [(keys[i],Column(data,i,ncols)) for i in xrange(len(keys))]
+        return self.series[(type,variable)]
+
+def writeNpy(filepath,data,ncols):
+    #Write an array in NumPy's .npy format (float32), column after column (Fortran order)
+    #Each column is contiguous and the file can be memory-mapped, e.g. numpy.load(filepath,mmap_mode="r")
+    if ncols > 0:
+        nrows = len(data) // ncols
+    else:
+        nrows = 0
+    header = "{'descr': '<f4', 'fortran_order': True, 'shape': (%d, %d), }" % (nrows,ncols)
+    header += " "*((64-(len(header)+11)%64)%64) + "\n" #the data starts at a multiple of 64 bytes
+    out_file = open(filepath,"wb")
+    out_file.write("\x93NUMPY\x01\x00"+struct.pack("<H",len(header))+header)
+    for c in xrange(ncols):
+        values = array.array('f',data[c::ncols])
+        if sys.byteorder == "big":
+            values.byteswap()
+        values.tofile(out_file)
+    out_file.close()
+
+def exportResults(results,path):
+    #Export every output of a project as one .npy file per output, with an index of the columns in columns.json
+    folder = path+results.name+"_columns"
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    meta = {"name": results.name, "outputs": {}}
+    for type in results.types():
+        header, data, ncols = results.load(type)
+        columns = []
+        for title in header.split()[:ncols]:
+            key = parseColumn(title)
+            if key == None:
+                key = (None,None,title,None)
+            columns.append({"title": title, "building": key[0], "surface": key[1], "variable": key[2], "unit": key[3]})
+        writeNpy(os.path.join(folder,type+".npy"),data,ncols)
+        meta["outputs"][type] = {"file": type+".npy",
+                                 "shape": [len(data)//max(ncols,1),ncols],
+                                 "columns": columns, #surface is the zone for TH
+                                 "rows": results.labels.get(type)} #row titles, e.g. for VF
+    out_file = open(os.path.join(folder,"columns.json"),"w")
+    json.dump(meta,out_file,indent=1,encoding="latin-1")
+    out_file.close()
+    return folder
+
+ReqInputs = True
+
+if period != None and not isPeriod(period):
+    warning = "period must be " + ", ".join(PERIODS) + " or a comma-separated list of first hours"
+    ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
+    print warning
+    ReqInputs = False
+
+if stat == None:
+    stat = "sum"
+elif stat not in STATS:
+    warning = "stat must be " + ", ".join(STATS)
+    ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
+    print warning
+    ReqInputs = False
+
+if Run and ReqInputs:
+    SWcols = selectColumns(readHeader(dir+name+"_SW.out"),selection)
+    THcols = selectColumns(readHeader(dir+name+"_TH.out"),selection,level="building")
+    if yearly: #only the yearly totals are kept
+        load = sumOut
+    else:
+        load = loadCached
+    #Parse the output files on separate threads while the geometry is extracted
+    SWjob = Job(load,dir+name+"_SW.out",SWcols)
+    THjob = Job(load,dir+name+"_TH.out",THcols)
+    SWjob.start()
+    THjob.start()
+    geometry = getSurfaces(_HBZones)
+    header, data, ncols = SWjob.get()
+    THhead, THdata, THncols = THjob.get()
     bIDs, sIDs = parseHead(header)
-    irrS = parseRes(results,sIDs)
-    irrS2, bIDs2, sIDs2, annIrr = removeTerr(irrS,bIDs,sIDs)
+    irrS = parseRes(data,ncols)
+    irrS2, bIDs2, sIDs2 = removeTerr(irrS,bIDs,sIDs)
     
     
-    #Create a dictionary from the output file
-    diction = {}
-    for i in xrange(len(bIDs2)):
-        diction[str(bIDs2[i])+"-"+str(sIDs2[i])]= irrS2[i]
-        
-    #Create lists of IDs from geometry data tree
-    bIDs3 = []
-    sIDs3 = []
-    for b in xrange(len(geometry)):
-        for s in xrange(len(geometry[b])):
-            bldgid, srfid = b, s, 
-            bIDs3.append(int(bldgid))
-            sIDs3.append(int(srfid))
-    bIDs3set = list(set(bIDs3)) #create a set of unique building IDs from geometry data tree
+    #Map the geometry IDs to the columns of the output file
+    index = indexColumns(bIDs2,sIDs2,geometry)
     
     #Iterate over the geometry IDs
     hSW = []
-    ySW = []
-    for b in bIDs3set:
+    for b in xrange(len(index)):
         hrl = []
-        yrl = []
-        for s in xrange(len(sIDs3)):
-            if bIDs3[s] == b:
-                #print b, sIDs2[s]
-                #print str(b)+'-'+str(sIDs3[s])
-                hrl.append(diction.get(str(b)+'-'+str(sIDs3[s]),[-1])) #if the key is valid retun list of hourly values, otherwise empty list
-                yrl.append([sum(diction.get(str(b)+'-'+str(sIDs3[s]),[-1]))])
-        ySW.append(yrl)
+        for c in index[b]:
+            if c >= 0:
+                hrl.append(irrS2[c]) #hourly values (or yearly totals)
+            else:
+                hrl.append([-1]) #missing surface
         hSW.append(hrl)
-    if yearly:
-        SW = list_to_tree(ySW,none_and_holes=True, source=[])
-        heating, cooling = ParseTHres(THres,yrl=True)
-        H = list_to_tree(heating,none_and_holes=True, source=[])
-        C = list_to_tree(cooling,none_and_holes=True, source=[])
+    THindex = ParseTHhead(THhead)
+    heating = ParseTHres(THdata,THncols,THindex,"Heating",len(geometry),yearly)
+    cooling = ParseTHres(THdata,THncols,THindex,"Cooling",len(geometry),yearly)
+    if THvars != None and len(THvars) > 0:
+        THres = [ParseTHres(THdata,THncols,THindex,v,len(geometry),yearly) for v in THvars]
     else:
-        SW = list_to_tree(hSW,none_and_holes=True, source=[])
-        heating, cooling = ParseTHres(THres)
-        H = list_to_tree(heating,none_and_holes=True, source=[])
-        C = list_to_tree(cooling,none_and_holes=True, source=[]) 
+        THres = []
+    if not yearly and period != None and period != "hourly":
+        hSW = [[aggregate(v,period,stat) for v in bldg] for bldg in hSW]
+        heating = [aggregate(v,period,stat) for v in heating]
+        cooling = [aggregate(v,period,stat) for v in cooling]
+        THres = [[aggregate(v,period,stat) for v in var] for var in THres]
+    SW = list_to_tree(hSW,none_and_holes=True, source=[])
+    H = list_to_tree(heating,none_and_holes=True, source=[])
+    C = list_to_tree(cooling,none_and_holes=True, source=[])
+    if len(THres) > 0:
+        TH = list_to_tree(THres,none_and_holes=True, source=[])
+    Results = CitySimResults(dir,name)
+    if Export:
+        print "Results exported to " + exportResults(Results,dir)
     
     Geometry = list_to_tree(geometry, source=[])
\ No newline at end of file
@@ -25,6 +25,7 @@ Ladybug: A Plugin for Environmental Analysis (GPL) started by Mostapha Sadeghipo
         name: name of the project
         yearly: Loads yearly results (default = False)
         geometry: same geometry used as simulation input
+        selection: List of buildings (e.g. "0") or surfaces (e.g. "0-2") to load; non-selected surfaces return -1. Default = all
         type: choose between SW or DC (default = SW)
         Run: set Boolean to True to load the results
     Returns:
@@ -33,7 +34,7 @@ Ladybug: A Plugin for Environmental Analysis (GPL) started by Mostapha Sadeghipo
 
 ghenv.Component.Name = "Honeybee_CitySim-LoadSolar"
 ghenv.Component.NickName = 'CitySim-LoadSolar'
-ghenv.Component.Message = 'VER 0.0.2\nAVR_01_2017'
+ghenv.Component.Message = 'VER 0.0.3\nOCT_18_2026'
 ghenv.Component.Category = "Honeybee"
 ghenv.Component.SubCategory = "14 | CitySim"
 try: ghenv.Component.AdditionalHelpFromDocStrings = "2"
@@ -42,6 +43,8 @@ except: pass
 import rhinoscriptsyntax as rs
 import scriptcontext as sc
 import uuid
+import array
+import os
 
 #Default values
 type = "SW"
@@ -92,19 +95,103 @@ def list_to_tree(input, none_and_holes=True, source=[0]):
     if input is not None: t=Tree[object]();proc(input,t,source[:]);return t
     
     
-def loadOut(path,name,type="SW",yearly=True):
-    #Load SW output file
-    if yearly:
-        ending = "_yearly.out"
-    else:
-        ending = ".out"
-    in_file = open(path+name+"_"+type+ending,"r")
-    txt = in_file.read()
+def readHeader(filepath):
+    #Read only the first line of an output file
+    in_file = open(filepath,"r")
+    header = in_file.readline()
     in_file.close()
-    results = txt.splitlines()
-    header = results[0]
-    results.pop(0) #remove header
-    return header, results
+    return header
+
+def loadArray(filepath,columns=None):
+    #Load output file into a contiguous float32 array (hours x columns, row by row)
+    #If a list of columns is given, only those are converted and the header is restricted to them
+    in_file = open(filepath,"r")
+    header = in_file.readline()
+    ncols = len(header.split())
+    data = array.array('f')
+    for l in in_file: #for each line corresponding to a hour
+        values = l.split()
+        if len(values) != ncols:
+            continue #skip empty or truncated lines
+        if columns == None:
+            data.extend([float(i) for i in values])
+        else:
+            data.extend([float(values[c]) for c in columns])
+    in_file.close()
+    if columns != None:
+        header, ncols = selectHeader(header,columns)
+    return header, data, ncols
+
+def selectHeader(header,columns):
+    #Header restricted to the selected columns
+    titles = header.split()
+    return "\t".join([titles[c] for c in columns]), len(columns)
+
+def takeColumns(data,ncols,columns):
+    #Copy the selected columns of an array into a new array
+    selected = array.array(data.typecode)
+    for r in xrange(0,len(data),ncols): #for each row
+        selected.extend([data[r+c] for c in columns])
+    return selected
+
+class Column(object):
+    """Series of one column of the results array (a view, values are not copied)"""
+    def __init__(self, data, col, ncols):
+        self.data = data
+        self.col = col
+        self.ncols = ncols
+    
+    def __len__(self):
+        return len(self.data) // self.ncols
+    
+    def __getitem__(self, h):
+        if h < 0:
+            h += len(self)
+        if h < 0 or h >= len(self):
+            raise IndexError("hour out of range")
+        return self.data[h*self.ncols+self.col]
+    
+    def __iter__(self):
+        data = self.data
+        for i in xrange(self.col, len(data), self.ncols):
+            yield data[i]
+
+def loadCached(filepath,columns=None):
+    #Load output file from its binary sidecar, which is rebuilt when the output changes
+    #Sidecar: key line (path, size, mtime), output header, array size, raw float32 values
+    #A selection of columns is taken from a valid sidecar, otherwise only those columns are parsed
+    stat = os.stat(filepath)
+    key = "CitySimCache 1\t{0}\t{1}\t{2}\n".format(os.path.abspath(filepath),stat.st_size,repr(stat.st_mtime))
+    cachepath = filepath+".cache"
+    if os.path.exists(cachepath):
+        in_file = open(cachepath,"rb")
+        try:
+            if in_file.readline() == key:
+                header = in_file.readline()
+                ncols, nvalues = [int(i) for i in in_file.readline().split()]
+                data = array.array('f')
+                data.fromfile(in_file,nvalues)
+                if columns != None:
+                    data = takeColumns(data,ncols,columns)
+                    header, ncols = selectHeader(header,columns)
+                return header, data, ncols
+        except (ValueError, EOFError):
+            pass #incomplete sidecar: parse the text file again
+        finally:
+            in_file.close()
+    if columns != None:
+        return loadArray(filepath,columns) #a partial array is not cached
+    header, data, ncols = loadArray(filepath)
+    try:
+        out_file = open(cachepath,"wb")
+        out_file.write(key)
+        out_file.write(header.rstrip("\r\n")+"\n")
+        out_file.write("{0} {1}\n".format(ncols,len(data)))
+        data.tofile(out_file)
+        out_file.close()
+    except (IOError, OSError):
+        print "Could not write cache file " + cachepath
+    return header, data, ncols
 
 def parseHead(head):        
     #Parse header
@@ -127,23 +214,11 @@ def parseHead(head):
             sIDs.append(int(s))
     return bIDs, sIDs
 
-def parseRes(results,sIDs):
-    #Parse results
-    irrH = []
-
-    for l in results: #for each line corresponding to a hour
-        bldg = []
-        isrf = []
-        for i in l.split(): #split the surfaces
-            isrf.append(float(i))
-        irrH.append(isrf)
-    #print len(isrf)
+def parseRes(data,ncols):
+    #Parse results into one series per column
     irrS = []
-    for s in xrange(len(sIDs)): #for each surface
-        srf = []
-        for h in range(len(irrH)): #for each hour
-            srf.append(irrH[h][s])
-        irrS.append(srf)
+    for s in xrange(ncols): #for each surface
+        irrS.append(Column(data,s,ncols))
     return irrS
 
 def removeTerr(irrS,bIDs,sIDs):   
@@ -161,37 +236,78 @@ def removeTerr(irrS,bIDs,sIDs):
     return irrS2, bIDs2, sIDs2
 
 
+def indexColumns(bIDs2,sIDs2,geometry):
+    #Result column of each surface in the geometry, building by building (-1 if missing)
+    columns = {}
+    for i in xrange(len(bIDs2)):
+        columns[(bIDs2[i],sIDs2[i])] = i
+    index = []
+    for b in xrange(len(geometry)):
+        index.append([columns.get((b,s),-1) for s in xrange(len(geometry[b]))])
+    return index
+
+def parseColumn(title):
+    #Split a column title, e.g. 0(1):1:Heating(Wh), into building, surface (or zone), variable and unit
+    import re
+    m = re.match(r'^(\w+)\((\w+)\):(\d+)?:?(?:([^(]+)\((.*)\))?$', title.lstrip("#"))
+    if m == None:
+        return None #columns not related to a building, e.g. #timeStep
+    b, key, n, var, unit = m.groups()
+    if b.isdigit():
+        b = int(b)
+    if n != None:
+        n = int(n)
+    return b, n, var, unit
+
+def selectColumns(header,selection,level="surface"):
+    #Resolve a selection of buildings ("0") or surfaces ("0-2") to the columns of an output file
+    #With level="building" (e.g. TH output) a selected surface selects its whole building
+    if selection == None or len(selection) == 0:
+        return None #all columns
+    bldgs = set()
+    srfs = set()
+    for item in selection:
+        ids = str(item).split("-")
+        if len(ids) == 1:
+            bldgs.add(int(ids[0]))
+        else:
+            srfs.add((int(ids[0]),int(ids[1])))
+    if level == "building":
+        bldgs.update([b for b, s in srfs])
+    columns = [0] #the first column is not related to buildings but is always kept
+    for c, title in enumerate(header.split()):
+        key = parseColumn(title)
+        if c == 0 or key == None:
+            continue
+        if key[0] in bldgs or (level == "surface" and (key[0],key[1]) in srfs):
+            columns.append(c)
+    return columns
+
+
 if Run:
-    header, results = loadOut(dir,name,type,yearly)
+    if yearly:
+        ending = "_yearly.out"
+    else:
+        ending = ".out"
+    columns = selectColumns(readHeader(dir+name+"_"+type+ending),selection)
+    header, data, ncols = loadCached(dir+name+"_"+type+ending,columns)
     bIDs, sIDs = parseHead(header)
-    irrS = parseRes(results,sIDs)
+    irrS = parseRes(data,ncols)
     irrS2, bIDs2, sIDs2 = removeTerr(irrS,bIDs,sIDs)
     
     
-    #Create a dictionary from the output file
-    diction = {}
-    for i in xrange(len(bIDs2)):
-        diction[str(bIDs2[i])+"-"+str(sIDs2[i])]= irrS2[i]
-        
-    #Create lists of IDs from geometry data tree
-    bIDs3 = []
-    sIDs3 = []
-    for b in xrange(len(geometry)):
-        for s in xrange(len(geometry[b])):
-            bldgid, srfid = b, s, 
-            bIDs3.append(int(bldgid))
-            sIDs3.append(int(srfid))
-    bIDs3set = list(set(bIDs3)) #create a set of unique building IDs from geometry data tree
+    #Map the geometry IDs to the columns of the output file
+    index = indexColumns(bIDs2,sIDs2,geometry)
     
     #Iterate over the geometry IDs
     output = []
-    for b in bIDs3set:
+    for b in xrange(len(index)):
         bldg = []
-        for s in xrange(len(sIDs3)):
-            if bIDs3[s] == b:
-                #print b, sIDs2[s]
-                #print str(b)+'-'+str(sIDs3[s])
-                bldg.append(diction.get(str(b)+'-'+str(sIDs3[s]),[-1])) #if the key is valid retun list of hourly values, otherwise empty list
+        for c in index[b]:
+            if c >= 0:
+                bldg.append(irrS2[c]) #hourly values
+            else:
+                bldg.append([-1]) #missing surface
         output.append(bldg)
 
     results = list_to_tree(output,none_and_holes=True, source=[])
\ No newline at end of file
@@ -34,15 +34,23 @@ Ladybug: A Plugin for Environmental Analysis (GPL) started by Mostapha Sadeghipo
         type: type of simulation (F = Full thermal + SW, I = SW-only). Default = F
         dir: Directory of simulation
         name: name of the project
-        Write: Boolean to write the XML file
-        Run: Boolean to start the simulation
+        Scenarios: Optional list of parameter sets (dictionaries or JSON strings) to write one XML file <name>_<k>.xml per set, extracting the geometry only once. Keys (all optional, the inputs of the component are used for missing keys): "Windows" (ratios as in _Windows, or list of them per building), "Occupancy" (as in _Occupancy, or list per building), "Constructions" (dictionary of replacements: {construction in the zones: construction to be used})
+        Tiles: Number of tiles in which the district is divided (k-d split of the building centroids), each simulated as a separate XML file <name>_t<k>.xml. The results are merged in <name>_*.out when all tiles are finished. Default = 1 (no tiling)
+        Buffer: Distance (m) around each tile in which the other buildings are written as shading surfaces. Default = 50
+        Write: Boolean to write the XML file. Buildings that have not changed since the last Write are copied from the fragments in <dir>/<name>_fragments
+        Solver: Path of the CitySim solver (or of any executable taking the same arguments)
+        Cache: Directory of the result cache: simulations of identical XML, climate, horizon and schedule files are restored from it instead of being run. Default = <dir>/cache
+        CacheSize: Maximum size of the cache in MB, the least recently used results are removed first. 0 to disable the cache. Default = 2000
+        Workers: Maximum number of simulations running at the same time. Default = number of processors
+        Run: Boolean to start the simulation. The simulations run in background, each one writing its output to <xml>.log
     Returns:
         Out: nothing
+        Jobs: Status of each simulation: queued, running, done, cached or failed (with exit code and time)
 """
 
 ghenv.Component.Name = "Honeybee_CitySim-RunSimulation"
 ghenv.Component.NickName = 'CitySim-RunSimulation'
-ghenv.Component.Message = 'VER 0.2.3\nFEB_26_2019'
+ghenv.Component.Message = 'VER 0.2.4\nOCT_18_2026'
 ghenv.Component.IconDisplayMode = ghenv.Component.IconDisplayMode.application
 ghenv.Component.Category = "Honeybee"
 ghenv.Component.SubCategory = "14 | CitySim"
@@ -64,9 +72,18 @@ import shutil
 import collections
 import subprocess
 import copy
+import re
+import hashlib
+import json
+import threading
+import Queue
+import time
 
 rc.Runtime.HostUtils.DisplayOleAlerts(False)
 
+BUFFERSIZE = 1024*1024 #bytes of file buffer for writing the XML files
+OUTPUTS = (".out",".dat") #extensions of the output files of CitySim, <name>_<type>.<ext>
+
 #Default values
 
 type = "F"
@@ -93,6 +110,13 @@ EPMaterials.sort()
 EPWindowMaterials.sort()
 ThermMaterials.sort()
 
+def getConstructionIds():
+    #Id of each construction: its index in the sorted Honeybee library, same ids as in CitySim-Srf
+    names = sorted(sc.sticky["honeybee_constructionLib"].keys())
+    return dict([(names[i],i) for i in xrange(len(names))])
+
+constructionIds = getConstructionIds()
+
 
 def EPConstructionStr(constructionName):
         #This function has been copied (with some adaptations)
@@ -152,80 +176,140 @@ def getMaterialProperties(matName):
 
 #Get surfaces from Honeybee zones
 def getSurfaces(HBZones):
-    hb_hive = sc.sticky["honeybee_Hive"]()
     geometry = []
     HBO = hb_hive.callFromHoneybeeHive(HBZones)
     for b in HBO:
-        crvs = []
-        HBSurfaces  = hb_hive.addToHoneybeeHive(b.surfaces, ghenv.Component)
-        for s in HBSurfaces:
-            edges = rs.DuplicateEdgeCurves(s)
-            crvs.append(rs.JoinCurves(edges))
-        geometry.append(crvs)
+        geometry.append(getZoneSurfaces(b))
     return geometry
 
+def getZoneSurfaces(zone):
+    crvs = []
+    HBSurfaces  = hb_hive.addToHoneybeeHive(zone.surfaces, ghenv.Component)
+    for s in HBSurfaces:
+        edges = rs.DuplicateEdgeCurves(s)
+        crvs.append(rs.JoinCurves(edges))
+    return crvs
+
 def getAttributes(HBZones):
     # call the objects from the lib
     thermalZonesPyClasses = hb_hive.callFromHoneybeeHive(HBZones)
     attributes = [['Type of surface','Solar Reflectance','Boundary Condition']] #when you add an attribute, list here what it means. 
     zoneatt = []
     for zone in thermalZonesPyClasses:
-        type = []
-        srefl = []
-        BC = []
-        for srf in zone.surfaces:
-            if srf.type == 0:
-                type.append('Wall')
-            elif srf.type >= 2.0 and srf.type < 3.0: #Floor
-                type.append('Floor')
-            elif srf.type == 1:
-                type.append('Roof')
-            srf.construction = srf.EPConstruction
-            materials = EPConstructionStr(srf.construction)
-            if srf.BC =="Outdoors" or srf.BC=="Ground":
-                srefl.append(str((1 - float(getMaterialProperties(materials[0])[0][-2]))))
-            else:
-                srefl.append('None')
-            BC.append(srf.BC)
-        zoneatt.append([type,srefl,BC])    
+        zoneatt.append(getZoneAttributes(zone))
     attributes.append(zoneatt)
     return attributes
+
+def getZoneAttributes(zone):
+    type = []
+    srefl = []
+    BC = []
+    for srf in zone.surfaces:
+        if srf.type == 0:
+            type.append('Wall')
+        elif srf.type >= 2.0 and srf.type < 3.0: #Floor
+            type.append('Floor')
+        elif srf.type == 1:
+            type.append('Roof')
+        srf.construction = srf.EPConstruction
+        if srf.BC =="Outdoors" or srf.BC=="Ground":
+            srefl.append(getReflectance(srf.construction))
+        else:
+            getConstructionMaterials(srf.construction) #check that the construction is in the library
+            srefl.append('None')
+        BC.append(srf.BC)
+    return [type,srefl,BC]
      
+#Caches of the decomposed constructions and materials, filled once per export
+layersCache = {}
+materialsCache = {}
+constructionsCache = {}
+reflectanceCache = {}
+
 def getLayers(cnstrName):
-    return hb_EPMaterialAUX.decomposeEPCnstr(cnstrName.upper())
+    if cnstrName not in layersCache:
+        layersCache[cnstrName] = hb_EPMaterialAUX.decomposeEPCnstr(cnstrName.upper())
+    return layersCache[cnstrName]
     
 def getMaterials(matName):
-    return hb_EPMaterialAUX.decomposeMaterial(matName.upper(), ghenv.Component)
+    if matName not in materialsCache:
+        materialsCache[matName] = hb_EPMaterialAUX.decomposeMaterial(matName.upper(), ghenv.Component)
+    return materialsCache[matName]
+
+def getConstructionMaterials(cnstrName):
+    if cnstrName not in constructionsCache:
+        constructionsCache[cnstrName] = EPConstructionStr(cnstrName)
+    return constructionsCache[cnstrName]
+
+def getReflectance(cnstrName):
+    #Solar reflectance of the external layer of a construction
+    if cnstrName not in reflectanceCache:
+        materials = getConstructionMaterials(cnstrName)
+        reflectanceCache[cnstrName] = str((1 - float(getMaterialProperties(materials[0])[0][-2])))
+    return reflectanceCache[cnstrName]
 
 def getVolume(b):
     volume = _HBZones[b].GetVolume()
     return volume
 
-def getConLibrary():
-    xml = ''
+def getFileConstructions(CSfiles):
+    #Names of the constructions used by the terrain and shading files (type="id"), read once per Write
+    used = set()
+    missing = set()
+    for path in CSfiles:
+        if path != "":
+            in_file = open(path,"r")
+            for l in in_file:
+                for id in re.findall(r'type="(\d+)"', l):
+                    if int(id) < len(EPConstructions):
+                        used.add(EPConstructions[int(id)])
+                    else:
+                        missing.add(id)
+            in_file.close()
+    if missing:
+        warning = "Construction ids not in the Honeybee library: " + ", ".join(sorted(missing)) + ". Write the terrain and shading files again."
+        ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
+        print warning
+    return used
+
+def getUsedConstructions(fileConstructions):
+    #Names of the constructions used by the zones and by the terrain and shading files (see getFileConstructions)
+    used = set(fileConstructions)
+    for zone in thermalZonesPyClasses:
+        for srf in zone.surfaces:
+            if srf.BC == "Outdoors" or srf.BC == "Ground": #Only these surfaces are written
+                used.add(srf.EPConstruction)
+    return used
+
+def getConLibrary(used=None):
+    #Composites of the constructions in used (all constructions if None), with their id in the library
+    xml = []
     for c in range(len(EPConstructions)):
-        if getMaterials(getLayers(EPConstructions[c])[0][0])[0][0] == 'Material': 
-            xml += '<Composite id="{0}" name="{1}">\n'.format(c,EPConstructions[c])
-            for l in getLayers(EPConstructions[c])[0]:
+        if used != None and EPConstructions[c] not in used:
+            continue
+        layers = getLayers(EPConstructions[c])[0]
+        external = getMaterials(layers[0])
+        if external[0][0] == 'Material': 
+            xml.append('<Composite id="{0}" name="{1}">\n'.format(c,EPConstructions[c]))
+            for l in layers:
                 mats = getMaterials(l)[0]
                 if mats[0] == 'Material': #Check that the material has all properties we need
-                    xml += '<Layer Thickness="{0}" Conductivity="{1}" Cp="{2}" Density="{3}"/>\n'.format(mats[2],mats[3],mats[5],mats[4])
-            xml += '</Composite>\n'
-        elif getMaterials(getLayers(EPConstructions[c])[0][0])[0][0] == 'Material:NoMass': #This material has no mass
-               l = getLayers(EPConstructions[c])[0][0] #Take the external layer in a construction without mass
-               mats = getMaterials(l)[0]
+                    xml.append('<Layer Thickness="{0}" Conductivity="{1}" Cp="{2}" Density="{3}"/>\n'.format(mats[2],mats[3],mats[5],mats[4]))
+            xml.append('</Composite>\n')
+        elif external[0][0] == 'Material:NoMass': #This material has no mass
+               mats = external[0] #Take the external layer in a construction without mass
                try:
-                    i = getMaterials(l)[1].index('Thermal Resistance {m2-K/W}') #Index of resistance
+                    i = external[1].index('Thermal Resistance {m2-K/W}') #Index of resistance
                except:
                     pass
                try:
-                    i = getMaterials(l)[1].index('- Thermal Resistance {m2-K/W}') #Index of resistance
+                    i = external[1].index('- Thermal Resistance {m2-K/W}') #Index of resistance
                except:
                     pass
                UValue = 1/float(mats[i]) #Calculate U-value from R-Value
-               xml += '<Composite id="{0}" name="{1}" Uvalue="{2}">\n'.format(c,EPConstructions[c],UValue)
-               xml += '</Composite>\n'
-    return xml
+               xml.append('<Composite id="{0}" name="{1}" Uvalue="{2}">\n'.format(c,EPConstructions[c],UValue))
+               xml.append('</Composite>\n')
+    return "".join(xml)
 
 def tree_to_list(input, retrieve_base = lambda x: x[0]):
     """Returns a list representation of a Grasshopper DataTree"""
@@ -249,7 +333,7 @@ def getWindows():
        ratios = tree_to_list(_Windows, lambda x: x)
     else:
        #GlazingRatio="0.5" GlazingGValue="0.3" GlazingUValue="0.45" OpenableRatio="0"
-       ratios = [0.5,0.3,0.45,0.0]
+       ratios = [[0.5,0.3,0.45,0.0]]
     return ratios
     
 def getOccupancy():
@@ -279,16 +363,159 @@ def getCSobjs(CSobjs):
     return terrain,horizon,shading,schedule,climate
 
 
+def getBuildings(geometry,attributes,wratios,occupancy):
+    #Inputs of each building, decoded once before writing the XML
+    buildings = []
+    for b in xrange(len(geometry)):
+        wallwindows, occ = getBuildingInputs(b,wratios,occupancy)
+        buildings.append(getBuilding(b,geometry[b],attributes[1][b],wallwindows,occ))
+    return buildings
+
+def getBuildingInputs(b,wratios,occupancy):
+    #Window ratios of the walls and occupants of a building
+    if len(wratios) == 1: #This is the case when ratios are defined globally and not per building
+        wallwindows = wratios[0]
+    else:
+        wallwindows = wratios[b]
+    if len(occupancy) == 1: #This is the case when occupancy is defined globally and not per building
+        occ = occupancy[0]
+    else:
+        occ = occupancy[b]
+    return wallwindows, occ
+
+def getBuilding(b,curves,zoneatt,wallwindows,occ):
+    #Volume, ground floor, occupants and, for each surface to be written, id, type, construction id, reflectance and windows
+    types, srefl, BCs = zoneatt
+    surfaces = []
+    for s in xrange(len(curves)):
+        if BCs[s] == 'Outdoors' or BCs[s] == 'Ground': #Do not write surface with adjacent BC
+            if types[s] == 'Wall': #Use windows ratios only for walls
+                windows = wallwindows
+            else:
+                windows = [0,0,0,0] #default values for windows ratios for non-wall surfaces
+            surfaces.append([s,types[s],constructionIds[thermalZonesPyClasses[b].surfaces[s].EPConstruction],srefl[s],windows])
+    return {"volume": getVolume(b),
+            "groundFloor": "Ground" in BCs,
+            "occupants": occ,
+            "surfaces": surfaces}
+
+def getFingerprint(b,zone,wallwindows,occ):
+    #Hash of everything written for a building: id, vertices, types, boundary conditions, constructions, windows and occupants
+    data = [b,list(wallwindows),list(occ)]
+    for srf in zone.surfaces:
+        vertices = [(p.X,p.Y,p.Z) for p in srf.geometry.DuplicateVertices()]
+        data.append([srf.type,srf.BC,srf.EPConstruction,constructionIds.get(srf.EPConstruction),vertices])
+        if srf.BC == "Outdoors" or srf.BC == "Ground":
+            data.append(getReflectance(srf.EPConstruction))
+    return hashlib.md5(repr(data)).hexdigest()
+
+def getScenario(scenario,defaultWindows,defaultOccupancy):
+    #Window ratios, occupancy and construction replacements of a parameter set
+    #defaultWindows, defaultOccupancy: inputs of the component, used for missing keys
+    if isinstance(scenario,basestring):
+        scenario = json.loads(scenario)
+    wratios = scenario.get("Windows")
+    if wratios == None:
+        wratios = defaultWindows
+    elif not isinstance(wratios[0],(list,tuple)): #This is the case when ratios are defined globally and not per building
+        wratios = [wratios]
+    occupancy = scenario.get("Occupancy")
+    if occupancy == None:
+        occupancy = defaultOccupancy
+    elif not isinstance(occupancy[0],(list,tuple)): #This is the case when occupancy is defined globally and not per building
+        occupancy = [occupancy]
+    constructions = scenario.get("Constructions",{})
+    for c in constructions.values():
+        if c not in constructionIds:
+            raise Exception("Construction " + c + " is not in the Honeybee library.")
+    return wratios, occupancy, constructions
+
+def applyScenario(buildings,wratios,occupancy,constructions):
+    #Replace the window ratios, occupants and constructions of the buildings, returns new buildings
+    #Volume, ground floor and surfaces are taken from buildings, extracted once for all the scenarios
+    scenario = []
+    for b in xrange(len(buildings)):
+        wallwindows, occ = getBuildingInputs(b,wratios,occupancy)
+        surfaces = []
+        for s, srftype, construction, srefl, windows in buildings[b]["surfaces"]:
+            if srftype == 'Wall': #Use windows ratios only for walls
+                windows = wallwindows
+            if EPConstructions[construction] in constructions:
+                cnstrName = constructions[EPConstructions[construction]]
+                construction = constructionIds[cnstrName]
+                srefl = getReflectance(cnstrName)
+            surfaces.append([s,srftype,construction,srefl,windows])
+        bldg = dict(buildings[b])
+        bldg["occupants"] = occ
+        bldg["surfaces"] = surfaces
+        scenario.append(bldg)
+    return scenario
+
+def getVertices(curves):
+    #XML of the vertices of each surface, formatted once and reused by every file
+    vertices = []
+    for crv in curves:
+        xml = []
+        srfpts = rs.CurvePoints(crv)
+        for i in xrange(len(srfpts)):
+            xml.append('<V' + str(i) + ' x="' + str(srfpts[i][0]) +'" y="' + str(srfpts[i][1]) +'" z="' + str(srfpts[i][2])+'"/> \n')
+        vertices.append("".join(xml))
+    return vertices
+
 #Create XML files in CitySim format
-def createXML(geometry,attributes):
-    #Header and default values
-    xml = ""
-    xml += getConLibrary()
-    #Windows ratios
+def createXML(vertices,buildings,fileConstructions,constructions=None):
+    #Generator of XML fragments: the construction library, then one fragment per building
+    #vertices: XML of the vertices of the surfaces of each building, see getVertices
+    used = getUsedConstructions(fileConstructions)
+    if constructions != None: #Add the replacements of a scenario
+        used.update(constructions.values())
+    yield getConLibrary(used)
+    for b in xrange(len(vertices)):
+        yield createBuilding(b,vertices[b],buildings[b])
+
+def createXMLIncremental(path,fileConstructions,subset=None,used=None):
+    #As createXML, but buildings that have not changed since the last export are copied from the fragments in path
+    #Only the other buildings are extracted from the Honeybee zones and written again
+    #subset: ids of the buildings to be written (all if None)
+    #used: set to which the fragments are added, if None the fragments not used by this file are removed
+    if not os.path.exists(path):
+        os.makedirs(path)
+    yield getConLibrary(getUsedConstructions(fileConstructions))
     wratios = getWindows()
-    #Add geometry to the XML file
-    for b in xrange(len(geometry)):
-        xml += '''<Building Name="GROUP_1" id="'''+ str(b) + '''" key="1" Vi="1123.5" Ninf="0.15" BlindsLambda="0.2" BlindsIrradianceCutOff="100" Simulate="true">
+    occupancy = getOccupancy()
+    cleanup = used == None
+    if cleanup:
+        used = set()
+    if subset == None:
+        subset = xrange(len(thermalZonesPyClasses))
+    for b in subset:
+        zone = thermalZonesPyClasses[b]
+        wallwindows, occ = getBuildingInputs(b,wratios,occupancy)
+        fragpath = os.path.join(path,getFingerprint(b,zone,wallwindows,occ)+".xml")
+        used.add(fragpath)
+        if os.path.exists(fragpath):
+            in_file = open(fragpath,"r")
+            xml = in_file.read()
+            in_file.close()
+        else:
+            curves = getZoneSurfaces(zone)
+            xml = createBuilding(b,getVertices(curves),getBuilding(b,curves,getZoneAttributes(zone),wallwindows,occ))
+            out_file = open(fragpath,"w")
+            out_file.write(xml)
+            out_file.close()
+        yield xml
+    if cleanup:
+        removeFragments(path,used)
+
+def removeFragments(path,used):
+    for f in os.listdir(path): #remove the fragments of buildings that have changed
+        if os.path.join(path,f) not in used:
+            os.remove(os.path.join(path,f))
+
+def createBuilding(b,vertices,bldg):
+    #XML of a building
+    xml = []
+    xml.append('''<Building Name="GROUP_1" id="'''+ str(b) + '''" key="1" Vi="1123.5" Ninf="0.15" BlindsLambda="0.2" BlindsIrradianceCutOff="100" Simulate="true">
                 <HeatTank V="0.01" phi="20" rho="1000" Cp="4180" Tmin="20" Tmax="35"/>
 			    <CoolTank V="0.01" phi="20" rho="1000" Cp="4180" Tmin="5" Tmax="20"/>
 			    <HeatSource beginDay="1" endDay="365">
@@ -296,42 +523,79 @@ def createXML(geometry,attributes):
 			    </HeatSource>
 			    <CoolSource beginDay="1" endDay="365">
 				    <HeatPump Pmax="10000000" eta_tech="0.3" Ttarget="5" Tsource="ground" depth="5" alpha="0.0700000003" position="vertical" z1="10" />
-			    </CoolSource>\n'''
-
-        #Check if there is a surface with BC=Ground
-        GroundFloor = False #default no ground
-        for BC in attributes[1][b][2]:
-            if BC =="Ground":
-                GroundFloor = True
-        xml += '<Zone id="1" volume="{0}" psi="0.2" Tmin="20" Tmax="26" groundFloor="{1}" >'.format(getVolume(b),str(GroundFloor))
-        
-        occupancy = getOccupancy()
-        if len(occupancy) == 1:
-            occ = occupancy[0]
-        else:
-            occ = occupancy[b]
-        xml +=	'<Occupants n="{0}" type="{1}"/>\n'.format(occ[0],occ[1])
-        
-        for s in xrange(len(geometry[b])):
-            #xml += '<' + attributes[1][b][0][s] + ' id="'+str(s)+'" type="'+ str(EPConstructions.index(thermalZonesPyClasses[b].surfaces[s].EPConstruction))+'" ShortWaveReflectance="' + attributes[1][b][1][s] + '" GlazingRatio="0.25" GlazingGValue="0.7" GlazingUValue="1.1" OpenableRatio="0">\n'
-            if attributes[1][b][0][s] == 'Wall' and len(wratios)>1: #Use windows ratios only for walls
-                windows = wratios[b]
-            elif attributes[1][b][0][s] == 'Wall' and len(wratios)==1: #This is the case when ratios are defined globally and not per building
-                windows = wratios[0]
-            else:
-                windows = [0,0,0,0] #default values for windows ratios for non-wall surfaces
-            
-            if attributes[1][b][2][s] == 'Outdoors' or attributes[1][b][2][s] == 'Ground': #Do not write surface with adjacent BC
-                xml += '<{0} id="{1}" type="{2}" ShortWaveReflectance="{3}" GlazingRatio="{4}" GlazingGValue="{5}" GlazingUValue="{6}" OpenableRatio="{7}">\n'.format(attributes[1][b][0][s],s,EPConstructions.index(thermalZonesPyClasses[b].surfaces[s].EPConstruction),attributes[1][b][1][s],windows[0],windows[1],windows[2],windows[3])
-                srfpts = rs.CurvePoints(geometry[b][s])
-                for i in xrange(len(srfpts)):
-                    #print '<V' + str(i) + ' x="' + str(srfpts[i][0]) +'" y="' + str(srfpts[i][1]) +'" z="' + str(srfpts[i][2])+'"/> \n'
-                    xml+= '<V' + str(i) + ' x="' + str(srfpts[i][0]) +'" y="' + str(srfpts[i][1]) +'" z="' + str(srfpts[i][2])+'"/> \n'
-                xml+= '</' + attributes[1][b][0][s] + '>'
-        xml+= '''   </Zone>
-                </Building>'''
-    return xml
+			    </CoolSource>\n''')
+    xml.append('<Zone id="1" volume="{0}" psi="0.2" Tmin="20" Tmax="26" groundFloor="{1}" >'.format(bldg["volume"],str(bldg["groundFloor"])))
+    occ = bldg["occupants"]
+    xml.append('<Occupants n="{0}" type="{1}"/>\n'.format(occ[0],occ[1]))
+    
+    for s, srftype, construction, srefl, windows in bldg["surfaces"]:
+        xml.append('<{0} id="{1}" type="{2}" ShortWaveReflectance="{3}" GlazingRatio="{4}" GlazingGValue="{5}" GlazingUValue="{6}" OpenableRatio="{7}">\n'.format(srftype,s,construction,srefl,windows[0],windows[1],windows[2],windows[3]))
+        xml.append(vertices[s])
+        xml.append('</' + srftype + '>')
+    xml.append('''   </Zone>
+                </Building>''')
+    return "".join(xml)
     
+#Tiles of the district
+def getBoxes():
+    #XY bounding box of each building: xmin, ymin, xmax, ymax
+    boxes = []
+    for zone in _HBZones:
+        bbox = zone.GetBoundingBox(True)
+        boxes.append((bbox.Min.X,bbox.Min.Y,bbox.Max.X,bbox.Max.Y))
+    return boxes
+
+def splitTiles(boxes,indices,n):
+    #Split the buildings in n tiles of similar size, dividing the centroids at the median along the longest side
+    if n <= 1 or len(indices) <= 1:
+        return [indices]
+    centroids = dict([(i,((boxes[i][0]+boxes[i][2])/2,(boxes[i][1]+boxes[i][3])/2)) for i in indices])
+    xs = [centroids[i][0] for i in indices]
+    ys = [centroids[i][1] for i in indices]
+    if max(xs)-min(xs) >= max(ys)-min(ys):
+        axis = 0
+    else:
+        axis = 1
+    indices = sorted(indices,key=lambda i: centroids[i][axis])
+    n1 = n/2
+    k = max(1,min(len(indices)-1,len(indices)*n1/n))
+    return splitTiles(boxes,indices[:k],n1) + splitTiles(boxes,indices[k:],n-n1)
+
+def getBuffer(boxes,tile,distance):
+    #Buildings outside the tile whose bounding box is within distance of the bounding box of the tile
+    xmin = min([boxes[i][0] for i in tile]) - distance
+    ymin = min([boxes[i][1] for i in tile]) - distance
+    xmax = max([boxes[i][2] for i in tile]) + distance
+    ymax = max([boxes[i][3] for i in tile]) + distance
+    inside = set(tile)
+    buffer = []
+    for i in xrange(len(boxes)):
+        if i not in inside and boxes[i][0] <= xmax and boxes[i][2] >= xmin and boxes[i][1] <= ymax and boxes[i][3] >= ymin:
+            buffer.append(i)
+    return buffer
+
+def createShading(b,vertices,zoneatt):
+    #XML of the external surfaces of a building, as shading surfaces
+    types, srefl, BCs = zoneatt
+    xml = []
+    for s in xrange(len(vertices)):
+        if BCs[s] == 'Outdoors':
+            xml.append('<Surface id="b{0}-{1}"  ShortWaveReflectance="{2}">\n'.format(b,s,srefl[s]))
+            xml.append(vertices[s])
+            xml.append('</Surface>')
+    return "".join(xml)
+
+def createTile(path,fileConstructions,tile,buffer,used):
+    #XML of a tile: its buildings, then the buildings of the buffer as shading surfaces
+    for xml in createXMLIncremental(path,fileConstructions,tile,used):
+        yield xml
+    if buffer:
+        yield "<ShadingSurface>\n"
+        for b in buffer:
+            zone = thermalZonesPyClasses[b]
+            yield createShading(b,getVertices(getZoneSurfaces(zone)),getZoneAttributes(zone))
+        yield "</ShadingSurface>\n"
+
 def createHeader():
     xml = '''<?xml version="1.0" encoding="ISO-8859-1"?>
     <CitySim name="test">
@@ -350,63 +614,427 @@ def createFooter():
 
 #Write XML file
 def writeXML(xml, path, name):
+    #xml is either a string or an iterable of fragments, written one after the other
     xmlpath = path+name+".xml"
-    out_file = open(xmlpath,"w")
-    out_file.write(xml)
+    out_file = open(xmlpath,"w",BUFFERSIZE)
+    if isinstance(xml,basestring):
+        out_file.write(xml)
+    else:
+        for fragment in xml:
+            out_file.write(fragment)
+    out_file.close()
+
+#Join the parts of the XML file
+def joinXML(parts, xmlpath):
+    #Copy the parts (header, CitySim objects, main, footer) one after the other into the final file
+    out_file = open(xmlpath,"wb")
+    for part in parts:
+        in_file = open(part,"rb")
+        shutil.copyfileobj(in_file,out_file,BUFFERSIZE)
+        in_file.close()
     out_file.close()
+    return xmlpath
+
+#Merge the results of the tiles
+def readFields(line):
+    fields = line.rstrip("\r\n").split("\t")
+    if len(fields) > 1 and fields[-1] == "": #Trailing separator
+        fields.pop()
+    return fields
+
+def mergeColumns(paths,outpath):
+    #Join the columns of the files, columns whose title is in a previous file are skipped (e.g. time, terrain)
+    files = [open(path,"r") for path in paths]
+    titles = set()
+    columns = []
+    header = []
+    for f in files:
+        cols = []
+        fields = readFields(f.readline())
+        for c in xrange(len(fields)):
+            if fields[c].lstrip("#") not in titles:
+                cols.append(c)
+                if header:
+                    header.append(fields[c].lstrip("#"))
+                else:
+                    header.append(fields[c])
+        titles.update([title.lstrip("#") for title in fields])
+        columns.append(cols)
+    out_file = open(outpath,"w",BUFFERSIZE)
+    out_file.write("\t".join(header)+"\n")
+    while True:
+        lines = [f.readline() for f in files]
+        if lines[0] == "":
+            break
+        row = []
+        for line, cols in zip(lines,columns):
+            fields = readFields(line)
+            row.extend([fields[c] for c in cols if c < len(fields)])
+        out_file.write("\t".join(row)+"\n")
+    out_file.close()
+    for f in files:
+        f.close()
+
+def mergeRows(paths,outpath):
+    #Join the rows (one per building) of the files, sorted by building id
+    rows = {}
+    for path in paths:
+        in_file = open(path,"r")
+        header = in_file.readline()
+        for line in in_file:
+            fields = readFields(line)
+            if fields[0] not in rows:
+                rows[fields[0]] = line
+        in_file.close()
+    out_file = open(outpath,"w")
+    out_file.write(header)
+    for id in sorted(rows.keys(),key=lambda id: int(id.split("(")[0])):
+        out_file.write(rows[id])
+    out_file.close()
+
+def mergeTotals(paths,outpath):
+    #Sum the yearly totals of the files
+    labels = []
+    totals = {}
+    for path in paths:
+        in_file = open(path,"r")
+        header = in_file.readline()
+        for line in in_file:
+            fields = readFields(line)
+            if len(fields) < 2:
+                continue
+            if fields[0] not in totals:
+                labels.append(fields[0])
+                totals[fields[0]] = 0.0
+            try:
+                totals[fields[0]] += float(fields[1])
+            except ValueError:
+                totals[fields[0]] = float("nan")
+        in_file.close()
+    out_file = open(outpath,"w")
+    out_file.write(header)
+    for label in labels:
+        out_file.write("{0}\t{1}\n".format(label,totals[label]))
+    out_file.close()
+
+def mergeTiles(xmlpaths,path,name):
+    #Merge the .out files of the tiles into <name>_*.out
+    bases = [os.path.splitext(x)[0] for x in xmlpaths]
+    for f in os.listdir(path):
+        if f.startswith(os.path.basename(bases[0])+"_") and f.endswith(".out"):
+            suffix = f[len(os.path.basename(bases[0])):]
+            paths = [base+suffix for base in bases]
+            outpath = path+name+suffix
+            if suffix == "_YearlyResults.out":
+                mergeTotals(paths,outpath)
+                continue
+            in_file = open(paths[0],"r")
+            in_file.readline()
+            first = readFields(in_file.readline())[0]
+            in_file.close()
+            if re.match(r"^\d+\(\w+\):?$",first): #One row per building
+                mergeRows(paths,outpath)
+            else:
+                mergeColumns(paths,outpath)
+
+#Cache of the results
+class ResultCache(object):
+    """Output files of the simulations, stored by hash of their input files"""
+    
+    def __init__(self,path,size):
+        self.path = os.path.join(path,"")
+        self.size = size #bytes
+        self.lock = threading.Lock()
+    
+    def key(self,command,files):
+        #Hash of the command line and of the content of the input files
+        md5 = hashlib.md5(repr(command))
+        for path in files:
+            if path != "":
+                in_file = open(path,"rb")
+                for block in iter(lambda: in_file.read(BUFFERSIZE),""):
+                    md5.update(block)
+                in_file.close()
+        return md5.hexdigest()
+    
+    def outputs(self,xmlpath,since):
+        #Output files of a simulation: <name>_<type>.out and .dat files written after since
+        folder = os.path.dirname(xmlpath) or "."
+        base = os.path.splitext(os.path.basename(xmlpath))[0]
+        files = []
+        for f in os.listdir(folder):
+            path = os.path.join(folder,f)
+            if f.startswith(base+"_") and os.path.splitext(f)[1] in OUTPUTS and os.path.isfile(path):
+                if os.path.getmtime(path) >= since:
+                    files.append(f[len(base):])
+        return files
+    
+    def restore(self,key,xmlpath):
+        #Copy the cached outputs next to the XML file, returns False if they are not in the cache
+        entry = self.path+key
+        with self.lock:
+            if not os.path.isdir(entry):
+                return False
+            os.utime(entry,None) #Most recently used
+            base = os.path.splitext(xmlpath)[0]
+            for f in os.listdir(entry):
+                shutil.copyfile(os.path.join(entry,f),base+f)
+        return True
+    
+    def store(self,key,xmlpath,since):
+        #Copy the outputs of a simulation to the cache, then remove the least recently used results
+        base = os.path.splitext(xmlpath)[0]
+        entry = self.path+key
+        tmp = entry+".tmp"+str(threading.current_thread().ident)
+        if not os.path.exists(tmp):
+            os.makedirs(tmp)
+        try:
+            for f in self.outputs(xmlpath,since):
+                shutil.copyfile(base+f,os.path.join(tmp,f))
+            with self.lock:
+                if os.path.exists(entry):
+                    shutil.rmtree(tmp)
+                else:
+                    os.rename(tmp,entry)
+                self.evict()
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp,True)
+    
+    def evict(self):
+        entries = []
+        total = 0
+        for e in os.listdir(self.path):
+            entry = self.path+e
+            if not os.path.isdir(entry):
+                continue
+            if ".tmp" in e: #Left by an interrupted store
+                if os.path.getmtime(entry) < time.time()-24*3600:
+                    shutil.rmtree(entry,True)
+            else:
+                size = sum([os.path.getsize(os.path.join(entry,f)) for f in os.listdir(entry)])
+                entries.append((os.path.getmtime(entry),size,entry))
+                total += size
+        entries.sort()
+        for mtime, size, entry in entries:
+            if total <= self.size:
+                break
+            shutil.rmtree(entry)
+            total -= size
+
+#Run the simulations
+def runJob(command,xmlpath,job,cache=None,inputs=[]):
+    #Run the solver on a XML file, its output is written to <xml>.log
+    #With a cache, results of identical inputs are restored instead
+    job["status"] = "running"
+    start = time.time()
+    if cache != None:
+        key = cache.key(command,[xmlpath]+inputs)
+        if cache.restore(key,xmlpath):
+            job["exit"] = 0
+            job["time"] = time.time()-start
+            job["status"] = "cached"
+            return
+    log = open(xmlpath+".log","w")
+    try:
+        process = subprocess.Popen(command+[xmlpath],cwd=os.path.dirname(xmlpath) or None,stdout=log,stderr=subprocess.STDOUT)
+        job["exit"] = process.wait()
+    except Exception, e:
+        log.write(str(e))
+        job["exit"] = -1
+    log.close()
+    if job["exit"] == 0 and cache != None:
+        try:
+            cache.store(key,xmlpath,start-1) #1 s tolerance of file times
+        except Exception, e:
+            print "Could not store results in cache: " + str(e)
+    job["time"] = time.time()-start
+    if job["exit"] == 0:
+        job["status"] = "done"
+    else:
+        job["status"] = "failed"
+
+def runJobs(command,xmlpaths,jobs,workers,callback=None,cache=None,inputs=[],progress=None):
+    #Run the XML files on a pool of workers, callback is called when all are finished
+    #progress is called after each job, to report its status while the others run
+    queue = Queue.Queue()
+    for xmlpath in xmlpaths:
+        jobs[xmlpath] = {"status": "queued", "exit": None, "time": None}
+        queue.put(xmlpath)
+    def worker():
+        while True:
+            try:
+                xmlpath = queue.get_nowait()
+            except Queue.Empty:
+                return
+            runJob(command,xmlpath,jobs[xmlpath],cache,inputs)
+            if progress != None:
+                progress()
+    threads = [threading.Thread(target=worker) for i in xrange(max(1,min(workers,len(xmlpaths))))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    def wait():
+        for t in threads:
+            t.join()
+        if callback != None:
+            callback()
+    waiter = threading.Thread(target=wait)
+    waiter.daemon = True
+    waiter.start()
+    return waiter
+
+def jobStatus(xmlpath,job):
+    status = os.path.basename(xmlpath) + ": " + job["status"]
+    if job["time"] != None:
+        status += " (exit {0}, {1:.1f} s)".format(job["exit"],job["time"])
+    return status
+
+def expireComponent():
+    #Recompute the component from the UI thread to update the status of the jobs
+    #The flag in sticky makes this solution only refresh Jobs, without writing or running again
+    #While a refresh is pending, it is not requested again: that solution reads the latest status
+    key = "CitySim_refresh_"+str(ghenv.Component.InstanceGuid)
+    with refreshLock:
+        if sc.sticky.get(key,False):
+            return
+        sc.sticky[key] = True
+    try:
+        rc.RhinoApp.InvokeOnUiThread(System.Action(lambda: ghenv.Component.ExpireSolution(True)))
+    except:
+        sc.sticky.pop(key,False)
+
+if not sc.sticky.has_key("CitySim_refreshLock"):
+    sc.sticky["CitySim_refreshLock"] = threading.Lock()
+refreshLock = sc.sticky["CitySim_refreshLock"]
 
 terrain,horizon,shading,schedule,climate = getCSobjs(_CSobjs)
+with refreshLock:
+    refresh = sc.sticky.pop("CitySim_refresh_"+str(ghenv.Component.InstanceGuid),False) #Solution requested by finished jobs
 if dir != None:
-    dir += "\\" #Add \ in case is missing
+    dir = os.path.join(dir,"") #Add separator in case is missing
+    xmlpath = dir+name+'.xml'
     
 if climate == "":
     warning = "Missing climate file: add one as CSobj."
     ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
     print warning
 
-if Write:
-    geometry = getSurfaces(_HBZones)
-    attributes = getAttributes(_HBZones)
-    #terrain, horizon,shading,schedule = getextraXML()
-    xml = createXML(geometry,attributes)
-    writeXML(xml,dir,name+"_main")
+def getParts(main):
+    #Parts of the XML file, in order
+    parts = [dir+name+"_head.xml"]
+    if horizon != "":
+        parts.append(horizon)
+    if schedule != "":
+        parts.append(schedule)
+    parts.append(main)
+    if terrain != "":
+        parts.append(terrain)
+    if shading != "":
+        parts.append(shading)
+    parts.append(dir+name+"_foot.xml")
+    return parts
+
+if Tiles == None:
+    Tiles = 1
+if Buffer == None:
+    Buffer = 50
+
+if Tiles > 1 and Scenarios:
+    warning = "Tiles are not used with Scenarios."
+    ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
+    print warning
+    Tiles = 1
+
+if dir == None:
+    print "Select a directory" #this is mandatory: no default
+    xmlpaths = []
+elif Scenarios:
+    xmlpaths = [dir+name+"_"+str(k)+".xml" for k in xrange(len(Scenarios))]
+elif Tiles > 1:
+    boxes = getBoxes()
+    tiles = splitTiles(boxes,range(len(boxes)),Tiles)
+    xmlpaths = [dir+name+"_t"+str(t)+".xml" for t in xrange(len(tiles))]
+else:
+    xmlpaths = [xmlpath]
+
+if Write and not refresh and dir != None:
     header = createHeader()
     footer = createFooter()
     writeXML(header,dir,name+"_head")
     writeXML(footer,dir,name+"_foot")
-
-    xmlpath = dir+name+'.xml'
-
-    #Create copy command
-    join = "copy "+dir+name+"_head.xml"
-    if horizon != "":
-        join += "+" + horizon 
-    if schedule != "":
-        join += "+" + schedule
-    else:
+    if schedule == "":
         warning = "Missing occupancy schedule: add one as CSobj."
         ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
         print warning
-    join += "+" +dir+name+"_main.xml"
-    if terrain != "":
-        join += "+" + terrain
-    if shading != "":
-        join += "+" + shading
-    join += "+" +dir+name+"_foot.xml"
-    join += " " +dir+name+".xml"
-        
-    #Copy and join files
-    os.chdir(dir)
-    os.system(join)
+    fileConstructions = getFileConstructions([terrain,shading])
     
+    if Scenarios:
+        #Extract geometry and attributes once, then write one file per scenario
+        geometry = getSurfaces(_HBZones)
+        attributes = getAttributes(_HBZones)
+        vertices = [getVertices(curves) for curves in geometry]
+        defaultWindows = getWindows()
+        defaultOccupancy = getOccupancy()
+        buildings = getBuildings(geometry,attributes,defaultWindows,defaultOccupancy)
+        for k in xrange(len(Scenarios)):
+            wratios, occupancy, constructions = getScenario(Scenarios[k],defaultWindows,defaultOccupancy)
+            scenario = applyScenario(buildings,wratios,occupancy,constructions)
+            writeXML(createXML(vertices,scenario,fileConstructions,constructions),dir,name+"_"+str(k)+"_main")
+            joinXML(getParts(dir+name+"_"+str(k)+"_main.xml"),xmlpaths[k])
+    elif Tiles > 1:
+        #Write one file per tile, the fragments of the buildings are shared
+        used = set()
+        for t in xrange(len(tiles)):
+            xml = createTile(dir+name+"_fragments",fileConstructions,tiles[t],getBuffer(boxes,tiles[t],Buffer),used)
+            writeXML(xml,dir,name+"_t"+str(t)+"_main")
+            joinXML(getParts(dir+name+"_t"+str(t)+"_main.xml"),xmlpaths[t])
+        removeFragments(dir+name+"_fragments",used)
+    else:
+        #terrain, horizon,shading,schedule = getextraXML()
+        xml = createXMLIncremental(dir+name+"_fragments",fileConstructions)
+        writeXML(xml,dir,name+"_main")
+        joinXML(getParts(dir+name+"_main.xml"),xmlpath)
+    
+
+if Cache == None and dir != None:
+    Cache = dir+"cache"
+if CacheSize == None:
+    CacheSize = 2000
+
+if Workers == None:
+    Workers = System.Environment.ProcessorCount
+
+if not sc.sticky.has_key("CitySim_jobs"):
+    sc.sticky["CitySim_jobs"] = {}
+jobs = sc.sticky["CitySim_jobs"]
+
+if Run and not refresh and dir != None:
+    running = [x for x in xmlpaths if x in jobs and jobs[x]["status"] in ("queued","running")]
+    if running:
+        warning = "Simulation already running: " + ", ".join([os.path.basename(x) for x in running])
+        ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
+        print warning
+    else:
+        #Create simulation command
+        if type == "F": 
+            command = [Solver]
+        elif type =="I":
+            command = [Solver,"-I"]
+        #Run the simulations
+        cache = None
+        if CacheSize > 0:
+            cache = ResultCache(Cache,CacheSize*1024*1024)
+            if not os.path.exists(Cache):
+                os.makedirs(Cache)
+        callback = expireComponent
+        if Tiles > 1:
+            def callback(xmlpaths=xmlpaths,dir=dir,name=name):
+                if all([jobs[x]["exit"] == 0 for x in xmlpaths]):
+                    mergeTiles(xmlpaths,dir,name)
+                else:
+                    print "Results of the tiles not merged: some simulations failed."
+                expireComponent()
+        runJobs(command,xmlpaths,jobs,Workers,callback,cache,[climate,horizon,schedule],expireComponent)
 
-if Run:
-    #Create simulation command
-    if type == "F": 
-        simulation = '"{}" {}'.format(Solver, xmlpath)
-    elif type =="I":
-        simulation = '"{}" -I {}'.format(Solver, xmlpath)
-    #Run the simulation
-    os.chdir(dir)
-    os.system(join)
-    os.system(simulation)
\ No newline at end of file
+Jobs = [jobStatus(x,jobs[x]) for x in xmlpaths if x in jobs]
\ No newline at end of file
@@ -34,7 +34,7 @@ Ladybug: A Plugin for Environmental Analysis (GPL) started by Mostapha Sadeghipo
 
 ghenv.Component.Name = "Honeybee_CitySim-Solar"
 ghenv.Component.NickName = 'CitySim-Solar'
-ghenv.Component.Message = 'VER 0.0.3\nAVR_01_2017'
+ghenv.Component.Message = 'VER 0.0.4\nOCT_18_2026'
 ghenv.Component.IconDisplayMode = ghenv.Component.IconDisplayMode.application
 ghenv.Component.Category = "Honeybee"
 ghenv.Component.SubCategory = "14 | CitySim"
@@ -54,6 +54,8 @@ import collections
 import subprocess
 import copy
 
+BUFFERSIZE = 1024*1024 #bytes of file buffer for joining the XML files
+
 
 # written by Giulio Piacentino, giulio@mcneel.com
 def tree_to_list(input, retrieve_base = lambda x: x[0]):
@@ -146,12 +148,24 @@ def writeXML(xml, path, name):
     out_file.write(xml)
     out_file.close()
     
+#Join the parts of the XML file
+def joinXML(parts, xmlpath):
+    #Copy the parts (header, CitySim objects, main, footer) one after the other into the final file
+    out_file = open(xmlpath,"wb")
+    for part in parts:
+        in_file = open(part,"rb")
+        shutil.copyfileobj(in_file,out_file,BUFFERSIZE)
+        in_file.close()
+    out_file.close()
+    return xmlpath
+
 geometry = tree_to_list(geometry, lambda x: x)
 reflectance = tree_to_list(reflectance, lambda x: x)
 
 terrain,horizon,shading,climate = getCSobjs(_CSobjs)
 if dir != None:
-    dir += "\\" #Add \ in case is missing
+    dir = os.path.join(dir,"") #Add separator in case is missing
+    xmlpath = dir+name+'.xml'
 
 if climate == "":
     warning = "Missing climate file: add one as CSobj."
@@ -166,23 +180,17 @@ if Write:
     writeXML(header,dir,name+"_head")
     writeXML(footer,dir,name+"_foot")
 
-    xmlpath = dir+name+'.xml'
-
-    #Create copy command
-    join = "copy "+dir+name+"_head.xml"
+    #Join the files
+    parts = [dir+name+"_head.xml"]
     if horizon != "":
-        join += "+" + horizon 
-    join += "+" +dir+name+"_main.xml"
+        parts.append(horizon)
+    parts.append(dir+name+"_main.xml")
     if terrain != "":
-        join += "+" + terrain
+        parts.append(terrain)
     if shading != "":
-        join += "+" + shading
-    join += "+" +dir+name+"_foot.xml"
-    join += " " +dir+name+".xml"
-    
-    #Merge files
-    os.chdir(dir)
-    os.system(join)
+        parts.append(shading)
+    parts.append(dir+name+"_foot.xml")
+    joinXML(parts,xmlpath)
 
 #Run the simulation
 if Run:
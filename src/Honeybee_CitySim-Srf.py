@@ -31,6 +31,12 @@ Ladybug: A Plugin for Environmental Analysis (GPL) started by Mostapha Sadeghipo
         type: either "Surface" or "Terrain" - default = "Surface"
         Dup: Boolean to duplicate obstructing surfaces with reversed normals: Default = True
         Sim: Boolean to include the surfaces in the results: Default = False
+        Center: Center of the district, used with Radius
+        Radius: Faces with all vertices farther than Radius (m, horizontal distance) from Center are not written, use CitySim-Horizon to account for them as far field obstructions. Default = no limit
+        Buildings: Closed geometry of the simulated buildings (e.g. Honeybee zones). Shading faces within a building are not written
+        Distance: Shading faces farther than Distance (m) from the bounding boxes of all Buildings are not written. Default = no limit
+        Angle: Shading faces seen under a height angle (degrees) lower than Angle from the base of all Buildings are not written. Default = 0
+        Sides: Boolean to write, for each shading face, only the sides (front, back or both) facing at least one of the Buildings within Distance (or seen above Angle), instead of using Dup. Needs Distance or Angle. Default = False
         dir: directory of project
         name: title of project
         Write: Boolean to start
@@ -38,7 +44,7 @@ Ladybug: A Plugin for Environmental Analysis (GPL) started by Mostapha Sadeghipo
 
 ghenv.Component.Name = "Honeybee_CitySim-Srf"
 ghenv.Component.NickName = 'CitySim-Srf'
-ghenv.Component.Message = 'VER 0.0.5\nMAR_25_2019'
+ghenv.Component.Message = 'VER 0.0.6\nOCT_18_2026'
 ghenv.Component.IconDisplayMode = ghenv.Component.IconDisplayMode.application
 ghenv.Component.Category = "Honeybee"
 ghenv.Component.SubCategory = "14 | CitySim"
@@ -46,10 +52,152 @@ ghenv.Component.AdditionalHelpFromDocStrings = "1"
 
 
 import Rhino as rc
+import rhinoscriptsyntax as rs
 import scriptcontext as sc
 import Grasshopper.Kernel as gh
+import math
 
-EPConstructions = sc.sticky ["honeybee_constructionLib"].keys() 
+def getConstructionIds():
+    #Id of each construction: its index in the sorted Honeybee library, same ids as in CitySim-RunSimulation
+    names = sorted(sc.sticky["honeybee_constructionLib"].keys())
+    return dict([(names[i],i) for i in xrange(len(names))])
+
+constructionIds = getConstructionIds()
+
+def isFar(points,center,radius):
+    #True if all points are farther than radius (horizontal distance) from center
+    for p in points:
+        if (p.X-center.X)**2 + (p.Y-center.Y)**2 <= radius**2:
+            return False
+    return True
+
+def getBox(points):
+    #Bounding box of points: xmin, ymin, zmin, xmax, ymax, zmax
+    xs = [p.X for p in points]
+    ys = [p.Y for p in points]
+    zs = [p.Z for p in points]
+    return (min(xs),min(ys),min(zs),max(xs),max(ys),max(zs))
+
+class Grid(object):
+    """Uniform grid of bounding boxes in plan, to find the boxes near a point"""
+    
+    def __init__(self,boxes,size):
+        self.boxes = boxes
+        self.size = float(size)
+        self.zmin = min([b[2] for b in boxes]) #Lowest base of the buildings
+        self.cells = {}
+        self.bounds = None
+        for b in xrange(len(boxes)):
+            for cell in self.cellsOf(boxes[b],0):
+                self.cells.setdefault(cell,[]).append(b)
+        #First and last occupied cells, no need to look beyond them
+        i = [cell[0] for cell in self.cells]
+        j = [cell[1] for cell in self.cells]
+        self.bounds = (min(i),min(j),max(i),max(j))
+    
+    def cellsOf(self,box,distance):
+        i0 = int(math.floor((box[0]-distance)/self.size))
+        j0 = int(math.floor((box[1]-distance)/self.size))
+        i1 = int(math.floor((box[3]+distance)/self.size))
+        j1 = int(math.floor((box[4]+distance)/self.size))
+        if self.bounds != None:
+            i0 = max(i0,self.bounds[0])
+            j0 = max(j0,self.bounds[1])
+            i1 = min(i1,self.bounds[2])
+            j1 = min(j1,self.bounds[3])
+        return [(i,j) for i in xrange(i0,i1+1) for j in xrange(j0,j1+1)]
+    
+    def query(self,box,distance):
+        #Ids of the boxes that may be within distance of box
+        found = set()
+        for cell in self.cellsOf(box,distance):
+            found.update(self.cells.get(cell,[]))
+        return found
+
+def boxDistance(a,b):
+    #Distance between two bounding boxes, 0 if they intersect
+    d = 0
+    for i in xrange(3):
+        gap = max(a[i]-b[i+3],b[i]-a[i+3],0)
+        d += gap**2
+    return math.sqrt(d)
+
+def heightAngle(face,bldg):
+    #Height angle (degrees) of the top of face seen from the base of bldg, at the shortest horizontal distance
+    dx = max(face[0]-bldg[3],bldg[0]-face[3],0)
+    dy = max(face[1]-bldg[4],bldg[1]-face[4],0)
+    return math.degrees(math.atan2(face[5]-bldg[2],math.sqrt(dx**2+dy**2)))
+
+def contains(bldg,face):
+    #True if face is within the bounding box of bldg
+    for i in xrange(3):
+        if face[i] < bldg[i] or face[i+3] > bldg[i+3]:
+            return False
+    return True
+
+def isInside(points,solid):
+    #True if all points are inside the closed geometry (Brep or mesh) of a building
+    tolerance = sc.doc.ModelAbsoluteTolerance
+    for p in points:
+        if not solid.IsPointInside(rc.Geometry.Point3d(p.X,p.Y,p.Z),tolerance,False):
+            return False
+    return True
+
+def getReach(face,grid,distance,angle):
+    #Horizontal distance within which a building can see the face, None if unlimited
+    reach = None
+    if angle > 0: #Seen from the lowest base, the face is lower than angle beyond this distance
+        reach = max(face[5]-grid.zmin,0)/math.tan(math.radians(angle))
+    if distance != None and (reach == None or distance < reach):
+        reach = distance
+    return reach
+
+def getSides(points,grid,reach):
+    #Sides of a face visible from the buildings: front (side of the normal of the face) and back
+    #A side is visible if a corner of the bounding box of a building is in front of it
+    a = points[0]
+    if len(points) == 4:
+        u = (points[2].X-a.X,points[2].Y-a.Y,points[2].Z-a.Z)
+        v = (points[3].X-points[1].X,points[3].Y-points[1].Y,points[3].Z-points[1].Z)
+    else:
+        u = (points[1].X-a.X,points[1].Y-a.Y,points[1].Z-a.Z)
+        v = (points[2].X-a.X,points[2].Y-a.Y,points[2].Z-a.Z)
+    n = (u[1]*v[2]-u[2]*v[1],u[2]*v[0]-u[0]*v[2],u[0]*v[1]-u[1]*v[0])
+    near = grid.query(getBox(points),reach)
+    front = False
+    back = False
+    for b in near:
+        bldg = grid.boxes[b]
+        for x in (bldg[0],bldg[3]):
+            for y in (bldg[1],bldg[4]):
+                for z in (bldg[2],bldg[5]):
+                    d = n[0]*(x-a.X)+n[1]*(y-a.Y)+n[2]*(z-a.Z)
+                    if d > 0:
+                        front = True
+                    elif d < 0:
+                        back = True
+        if front and back:
+            break
+    return front, back
+
+def isCulled(face,points,grid,solids,reach,distance,angle):
+    #True if the face is within a building, or too far or too low to shade any of them
+    #Only the buildings within reach (see getReach) are searched, all faces are visible with no reach
+    if reach == None:
+        near = grid.query(face,0)
+        visible = True
+    else:
+        near = grid.query(face,reach)
+        visible = False
+    for b in near:
+        bldg = grid.boxes[b]
+        if contains(bldg,face) and isInside(points,solids[b]):
+            return True
+        if visible:
+            continue
+        if (distance == None or boxDistance(face,bldg) <= distance) and (angle == 0 or heightAngle(face,bldg) >= angle):
+            visible = True
+    return not visible
 
 
 #Default reflectance
@@ -78,6 +226,38 @@ if type == None:
 
 if name == None:
     name = "simulation" #default name
+
+if Radius != None and Center == None:
+    warning = "Add a Center to use Radius"
+    ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
+    print warning
+    Radius = None
+elif Center != None:
+    Center = rs.coerce3dpoint(Center)
+
+if Angle == None:
+    Angle = 0
+
+if Sides == None:
+    Sides = False
+
+if Buildings and type != "terrain":
+    boxes = []
+    for geo in Buildings:
+        bbox = geo.GetBoundingBox(True)
+        boxes.append((bbox.Min.X,bbox.Min.Y,bbox.Min.Z,bbox.Max.X,bbox.Max.Y,bbox.Max.Z))
+    if Distance != None:
+        size = max(Distance,1)
+    else: #About one building per cell
+        size = max(max([b[3]-b[0] for b in boxes]),max([b[4]-b[1] for b in boxes]),1)
+    grid = Grid(boxes,size)
+    if Sides and Distance == None and Angle == 0:
+        warning = "Add a Distance or an Angle to use Sides"
+        ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Warning, warning)
+        print warning
+        Sides = False
+else:
+    grid = None
     
 if dir == None:
     print "Select a directory" #this is mandatory: no default
@@ -92,6 +272,9 @@ elif Write == True and ReqInputs == True:
         FilePath = dir + name + ".gnd"
     else:
         FilePath = dir + name + ".shd"
+    far = 0
+    culled = 0
+    sides = 0
     with open(FilePath, "w") as outfile:
         obj = FilePath
         if type == "terrain":
@@ -101,30 +284,51 @@ elif Write == True and ReqInputs == True:
         for meshcount, Tmesh in enumerate(S):
             #for v in Tmesh.Vertices:
             facecount = 0
+            if type == "terrain":
+                s = "Ground"
+            else:
+                s = "Surface"
+            if len(EPConstructionName[meshcount]) > 0:
+                try:
+                    construction = 'type="{}"'.format(constructionIds[EPConstructionName[meshcount].upper()])
+                except:
+                     warning = "Check EPConstructionName"
+                     ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Error, warning)
+                     print(warning)
+                     construction = ""
+            else:
+                construction = ""
             for face in Tmesh.Faces:
-                if type == "terrain":
-                    s = "Ground"
+                if face.IsQuad:
+                    points = [Tmesh.Vertices[face.A],Tmesh.Vertices[face.B],Tmesh.Vertices[face.C],Tmesh.Vertices[face.D]]
                 else:
-                    s = "Surface"
-                if len(EPConstructionName[meshcount]) > 0:
-                    try:
-                        construction = 'type="{}"'.format(EPConstructions.index(EPConstructionName[meshcount].upper()))
-                    except:
-                         warning = "Check EPConstructionName"
-                         ghenv.Component.AddRuntimeMessage(gh.GH_RuntimeMessageLevel.Error, warning)
-                         print(warning)
-                         construction = ""
+                    points = [Tmesh.Vertices[face.A],Tmesh.Vertices[face.B],Tmesh.Vertices[face.C]]
+                if Radius != None and isFar(points,Center,Radius): #Far field, see CitySim-Horizon
+                    far += 1
+                    facecount += 1
+                    continue
+                if grid != None:
+                    box = getBox(points)
+                    reach = getReach(box,grid,Distance,Angle)
+                if grid != None and isCulled(box,points,grid,Buildings,reach,Distance,Angle):
+                    culled += 1
+                    facecount += 1
+                    continue
+                if Sides and grid != None:
+                    front, back = getSides(points,grid,reach)
+                    sides += 2 - front - back
                 else:
-                    construction = ""
-                outfile.write('<{0} id="s{1}" {3} ShortWaveReflectance="{2}">\n'.format(s,str(meshcount)+'-'+str(facecount),str(R[0]),construction))
-                outfile.write('<V0 x ="{0}" y="{1}" z ="{2}"/>\n'.format(Tmesh.Vertices[face.A].X,Tmesh.Vertices[face.A].Y,Tmesh.Vertices[face.A].Z))
-                outfile.write('<V1 x ="{0}" y="{1}" z ="{2}"/>\n'.format(Tmesh.Vertices[face.B].X,Tmesh.Vertices[face.B].Y,Tmesh.Vertices[face.B].Z))
-                outfile.write('<V2 x ="{0}" y="{1}" z ="{2}"/>\n'.format(Tmesh.Vertices[face.C].X,Tmesh.Vertices[face.C].Y,Tmesh.Vertices[face.C].Z))
-                if face.IsQuad:
-                    outfile.write('<V3 x ="{0}" y="{1}" z ="{2}"/>\n'.format(Tmesh.Vertices[face.D].X,Tmesh.Vertices[face.D].Y,Tmesh.Vertices[face.D].Z))
-                outfile.write('</{0}>'.format(s))
+                    front, back = True, Dup
+                if front:
+                    outfile.write('<{0} id="s{1}" {3} ShortWaveReflectance="{2}">\n'.format(s,str(meshcount)+'-'+str(facecount),str(R[0]),construction))
+                    outfile.write('<V0 x ="{0}" y="{1}" z ="{2}"/>\n'.format(Tmesh.Vertices[face.A].X,Tmesh.Vertices[face.A].Y,Tmesh.Vertices[face.A].Z))
+                    outfile.write('<V1 x ="{0}" y="{1}" z ="{2}"/>\n'.format(Tmesh.Vertices[face.B].X,Tmesh.Vertices[face.B].Y,Tmesh.Vertices[face.B].Z))
+                    outfile.write('<V2 x ="{0}" y="{1}" z ="{2}"/>\n'.format(Tmesh.Vertices[face.C].X,Tmesh.Vertices[face.C].Y,Tmesh.Vertices[face.C].Z))
+                    if face.IsQuad:
+                        outfile.write('<V3 x ="{0}" y="{1}" z ="{2}"/>\n'.format(Tmesh.Vertices[face.D].X,Tmesh.Vertices[face.D].Y,Tmesh.Vertices[face.D].Z))
+                    outfile.write('</{0}>'.format(s))
             
-                if Dup: #Duplicate surfaces with reversed normals
+                if back: #Duplicate surfaces with reversed normals
                     outfile.write('<{0} id="s{1}-verso" {3} ShortWaveReflectance="{2}">\n'.format(s,str(meshcount)+'-'+str(facecount),str(R[0]),construction))
                     if face.IsQuad:
                         outfile.write('<V3 x ="{0}" y="{1}" z ="{2}"/>\n'.format(Tmesh.Vertices[face.D].X,Tmesh.Vertices[face.D].Y,Tmesh.Vertices[face.D].Z))
@@ -137,6 +341,12 @@ elif Write == True and ReqInputs == True:
             outfile.write("</GroundSurface>")
         else:
             outfile.write("</ShadingSurface>")
+    if Radius != None:
+        print "{0} faces beyond Radius not written".format(far)
+    if grid != None:
+        print "{0} faces culled (within, too far or too low from Buildings)".format(culled)
+    if Sides and grid != None:
+        print "{0} sides of faces not visible from Buildings not written".format(sides)
     print "XML file created"
 elif Write == True and ReqInputs == False:
     warning = "Check Required Inputs"